@@ -9,20 +9,57 @@ import datetime
 import time
 import urllib3
 import math
-import string
 import signal
-import random
-import tempfile
 import threading
 import queue
+import string
+import random
+import multiprocessing
+import asyncio
+import ssl
+import urllib.parse
+import socket
+import json
+import hashlib
+import hmac
+import array
+import collections
+import statistics
+import platform
+import concurrent.futures
+import http.server
+import email.utils
+import resource
+import bisect
+import xml.etree.ElementTree
+from xml.sax.saxutils import escape
 import boto3
 import botocore
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
 
 def usage():
     print("Lightweight S3 Tester")
-    print("Usage: " + sys.argv[0] + " [-v] [-b bucket] [-c object_count] [-e end_point] [-s data_size] [-p profile] [-f file_prefix] [-d dest_dir] [-o test_op]")
+    print("Usage: " + sys.argv[0] + " [-v] [-b bucket] [-c object_count] [-e end_point] [-s data_size] [-p profile] [-f file_prefix] [-d dest_dir] [-o test_op] [-t threads] [-m]")
+    print("       [--pool connections] [--keepalive] [--connect-timeout seconds] [--read-timeout seconds]")
+    print("       [--unique] [--payload-buffer size] [--processes count]")
+    print("       [--engine thread|async] [--inflight requests]")
+    print("       [--agent-listen [host:]port] [--agents host:port[,host:port...]] [--agent-token token]")
+    print("       [--single-delete] [--list-shards] [--rate ops_per_sec]")
+    print("       [--mix get=70,put=20,head=5,delete=5,list=0] [--duration seconds] [--seed number]")
+    print("       [--key-dist sequential|uniform|zipf[:exponent]|hotspot[:keys,share]] [--keys key_space] [--hash-keys]")
+    print("       [--multipart-threshold size] [--part-size size] [--part-concurrency threads] [--explicit-multipart]")
+    print("       [--range-size size] [--range-offsets random|sequential] [--range-key object_name]")
+    print("       [--model-reps count] [--model-warmup passes] [--model-max threads] [--model-p99 ms]")
+    print("       [--series file.csv|file.json] [--phases] [--on-error stop|continue]")
+    print("       [--sink-buffer size] [--verify] [--result file.json] [--manifest file]")
+    print("       [--loopback discard|memory]")
+    print("       " + sys.argv[0] + " compare [--threshold pct] [--p99-threshold pct] baseline.json result.json [result.json ...]")
+    print("       data_size: bytes, 64KiB, uniform:4KiB-1MiB, lognormal:1MiB,1.5[,1GiB] or 60%4KiB,30%1MiB,10%64MiB")
+    print("       test_op: put, get, head, delete, list, mixed, range, prepare, exists, copy, put-tag, get-tag or put-empty")
 
 def signal_handler(signal,frame):
 
@@ -57,14 +94,922 @@ def formatSize(bytes):
 
     return print_str
 
+def parse_address(value, default_host):
+
+    host, sep, port = value.rpartition(':')
+    if len(sep) == 0:
+        host = default_host
+    if host is None or len(host) == 0:
+        print("Address %s must be in host:port format." % value)
+        sys.exit(1)
+    try:
+        return host, int(port)
+    except ValueError as e:
+        print("Port in %s must be a number." % value)
+        sys.exit(1)
+
+SIZE_UNITS = {'': 1, 'b': 1, 'bytes': 1, 'k': 1024, 'kb': 1024, 'kib': 1024, 'm': 1048576, 'mb': 1048576, 'mib': 1048576,
+              'g': 1073741824, 'gb': 1073741824, 'gib': 1073741824, 't': 1099511627776, 'tb': 1099511627776,
+              'tib': 1099511627776}
+
+def parse_size(value):
+
+    value = value.strip()
+    number = value.rstrip(string.ascii_letters)
+    unit = value[len(number):].lower()
+    if unit not in SIZE_UNITS:
+        raise ValueError("unknown size unit %s" % unit)
+
+    return int(float(number) * SIZE_UNITS[unit])
+
+def size_class(size):
+
+    limit = 1
+    while limit < size:
+        limit <<= 1
+
+    return "<=" + formatSize(limit).replace(' ', '')
+
+def report_order(op):
+
+    name, sep, size_label = op.partition(' <=')
+    if len(sep) == 0:
+        return name, -1
+
+    return name, parse_size(size_label)
+
+def key_hash(name):
+
+    return hashlib.md5(name.encode('utf-8')).hexdigest()[0:4]
+
+class key_distribution:
+
+    def __init__(self, spec, key_count):
+
+        kind, sep, params = spec.replace(' ', '').partition(':')
+        self.kind = kind.lower()
+        self.key_count = max(1, key_count)
+
+        if self.kind == 'zipf':
+            self.exponent = float(params) if len(params) > 0 else 0.99
+            if self.exponent <= 0:
+                raise ValueError("zipf exponent must be greater than zero")
+            self.stride = 2654435761 % self.key_count or 1
+            while math.gcd(self.stride, self.key_count) != 1:
+                self.stride += 1
+            self.h_x1 = self.h_integral(1.5) - 1.0
+            self.h_n = self.h_integral(self.key_count + 0.5)
+            self.squeeze = 2.0 - self.h_integral_inverse(self.h_integral(2.5) - self.h(2.0))
+        elif self.kind == 'hotspot':
+            values = params.split(',') if len(params) > 0 else []
+            self.hot_fraction = float(values[0]) if len(values) > 0 else 0.1
+            self.hot_share = float(values[1]) if len(values) > 1 else 0.9
+            if not 0 < self.hot_fraction <= 1 or not 0 <= self.hot_share <= 1:
+                raise ValueError("hotspot fractions must be between 0 and 1")
+            self.hot_keys = max(1, int(self.key_count * self.hot_fraction))
+        elif self.kind not in ('sequential', 'uniform'):
+            raise ValueError("unknown key distribution %s" % self.kind)
+
+    def sequential(self):
+
+        return self.kind == 'sequential'
+
+    def h(self, x):
+
+        return math.exp(-self.exponent * math.log(x))
+
+    def h_integral(self, x):
+
+        log_x = math.log(x)
+        t = (1.0 - self.exponent) * log_x
+        if abs(t) > 1e-8:
+            helper = math.expm1(t) / t
+        else:
+            helper = 1.0 + t / 2.0 + t * t / 6.0
+        return helper * log_x
+
+    def h_integral_inverse(self, x):
+
+        t = max(-1.0, x * (1.0 - self.exponent))
+        if abs(t) > 1e-8:
+            helper = math.log1p(t) / t
+        else:
+            helper = 1.0 - t / 2.0 + t * t / 3.0
+        return math.exp(helper * x)
+
+    def zipf_rank(self, rng):
+
+        while True:
+            u = self.h_n + rng.random() * (self.h_x1 - self.h_n)
+            x = self.h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self.key_count)
+            if k - x <= self.squeeze or u >= self.h_integral(k + 0.5) - self.h(k):
+                return k
+
+    def sample(self, rng):
+
+        if self.kind == 'uniform':
+            return rng.randint(1, self.key_count)
+        elif self.kind == 'zipf':
+            return ((self.zipf_rank(rng) - 1) * self.stride) % self.key_count + 1
+        elif rng.random() < self.hot_share or self.hot_keys == self.key_count:
+            return rng.randint(1, self.hot_keys)
+        else:
+            return rng.randint(self.hot_keys + 1, self.key_count)
+
+    def __str__(self):
+
+        if self.kind == 'zipf':
+            return "zipf %g" % self.exponent
+        elif self.kind == 'hotspot':
+            return "hotspot %g%% of keys take %g%% of requests" % (self.hot_fraction * 100, self.hot_share * 100)
+        else:
+            return self.kind
+
+class size_distribution:
+
+    def __init__(self, spec):
+
+        self.spec = spec.replace(' ', '')
+        kind, sep, params = self.spec.partition(':')
+        kind = kind.lower()
+
+        if '%' in self.spec:
+            self.kind = 'buckets'
+            self.sizes = []
+            self.weights = []
+            for entry in self.spec.split(','):
+                weight, size = entry.split('%', 1)
+                self.weights.append(float(weight))
+                self.sizes.append(parse_size(size))
+            if sum(self.weights) <= 0:
+                raise ValueError("bucket weights must add up to more than zero")
+        elif kind == 'uniform':
+            self.kind = 'uniform'
+            low, high = params.split('-', 1)
+            self.low = parse_size(low)
+            self.high = parse_size(high)
+            if self.low > self.high:
+                raise ValueError("uniform range minimum is larger than maximum")
+        elif kind == 'lognormal':
+            self.kind = 'lognormal'
+            values = params.split(',')
+            self.median = parse_size(values[0])
+            self.sigma = float(values[1]) if len(values) > 1 else 1.0
+            self.high = parse_size(values[2]) if len(values) > 2 else None
+            if self.median <= 0:
+                raise ValueError("lognormal median must be greater than zero")
+        else:
+            self.kind = 'fixed'
+            self.size = parse_size(self.spec)
+
+        if self.kind == 'fixed' and self.size < 0:
+            raise ValueError("size can not be negative")
+
+    def fixed(self):
+
+        return self.kind == 'fixed'
+
+    def sample(self, rng):
+
+        if self.kind == 'fixed':
+            return self.size
+        elif self.kind == 'uniform':
+            return rng.randint(self.low, self.high)
+        elif self.kind == 'lognormal':
+            size = max(1, int(rng.lognormvariate(math.log(self.median), self.sigma)))
+            if self.high is not None:
+                size = min(size, self.high)
+            return size
+        else:
+            return rng.choices(self.sizes, self.weights)[0]
+
+    def mean(self):
+
+        if self.kind == 'fixed':
+            return self.size
+        elif self.kind == 'uniform':
+            return (self.low + self.high) / 2
+        elif self.kind == 'lognormal':
+            return self.median * math.exp((self.sigma ** 2) / 2)
+        else:
+            return sum(size * weight for size, weight in zip(self.sizes, self.weights)) / sum(self.weights)
+
+    def __str__(self):
+
+        if self.kind == 'fixed':
+            return formatSize(self.size)
+        elif self.kind == 'uniform':
+            return "uniform %s to %s" % (formatSize(self.low), formatSize(self.high))
+        elif self.kind == 'lognormal':
+            return "lognormal median %s sigma %g" % (formatSize(self.median), self.sigma)
+        else:
+            return ', '.join("%g%% %s" % (weight, formatSize(size)) for size, weight in zip(self.sizes, self.weights))
+
+def parse_mix(value):
+
+    mix = {}
+    for entry in value.split(','):
+        op, sep, weight = entry.partition('=')
+        op = op.strip().lower()
+        if op not in MIXED_OPS:
+            print("Mixed operation %s must be one of %s." % (op, ', '.join(MIXED_OPS)))
+            sys.exit(1)
+        try:
+            mix[op] = float(weight)
+        except ValueError as e:
+            print("Weight for %s must be a number." % op)
+            sys.exit(1)
+        if mix[op] < 0:
+            print("Weight for %s can not be negative." % op)
+            sys.exit(1)
+
+    if sum(mix.values()) <= 0:
+        print("Operation mix must have at least one positive weight.")
+        sys.exit(1)
+
+    return mix
+
+def formatLatency(seconds):
+
+    if seconds >= 1:
+        return "%.2f s" % seconds
+    elif seconds >= 0.001:
+        return "%.2f ms" % (seconds * 1000)
+    else:
+        return "%.1f us" % (seconds * 1000000)
+
+class latency_histogram:
+
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+    SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+    MAX_VALUE = 1 << 38
+
+    def __init__(self):
+
+        self.bucket_count = self.bucket_index(self.MAX_VALUE - 1) + 1
+        self.counts = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0
+        self.bytes = 0
+        self.max_value = 0
+        self.min_value = None
+        self.first_start = None
+        self.last_end = None
+
+    def bucket_index(self, value):
+
+        if value < self.SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        return (shift * self.SUB_BUCKET_HALF) + (value >> shift)
+
+    def bucket_value(self, index):
+
+        if index < self.SUB_BUCKET_COUNT:
+            return index
+        shift = (index // self.SUB_BUCKET_HALF) - 1
+        sub_bucket = index - (shift * self.SUB_BUCKET_HALF)
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, start, end, size=0):
+
+        value = int((end - start) * 1000000)
+        value = min(max(value, 0), self.MAX_VALUE - 1)
+        self.counts[self.bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.bytes += size
+        self.max_value = max(self.max_value, value)
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.first_start is None or start < self.first_start:
+            self.first_start = start
+        if self.last_end is None or end > self.last_end:
+            self.last_end = end
+
+    def merge(self, other):
+
+        for index, bucket in enumerate(other.counts):
+            if bucket:
+                self.counts[index] += bucket
+        self.count += other.count
+        self.total += other.total
+        self.bytes += other.bytes
+        self.max_value = max(self.max_value, other.max_value)
+        if other.min_value is not None and (self.min_value is None or other.min_value < self.min_value):
+            self.min_value = other.min_value
+        if other.first_start is not None and (self.first_start is None or other.first_start < self.first_start):
+            self.first_start = other.first_start
+        if other.last_end is not None and (self.last_end is None or other.last_end > self.last_end):
+            self.last_end = other.last_end
+
+    def to_dict(self, clock_offset=0.0):
+
+        return {
+            'counts': {str(index): bucket for index, bucket in enumerate(self.counts) if bucket},
+            'count': self.count,
+            'total': self.total,
+            'bytes': self.bytes,
+            'max': self.max_value,
+            'min': self.min_value,
+            'first_start': None if self.first_start is None else self.first_start + clock_offset,
+            'last_end': None if self.last_end is None else self.last_end + clock_offset,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+
+        histogram = cls()
+        for index, bucket in data['counts'].items():
+            histogram.counts[int(index)] = bucket
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.bytes = data.get('bytes', 0)
+        histogram.max_value = data['max']
+        histogram.min_value = data['min']
+        histogram.first_start = data['first_start']
+        histogram.last_end = data['last_end']
+
+        return histogram
+
+    def percentile(self, pct):
+
+        if self.count == 0:
+            return 0.0
+        target = max(1, math.ceil(self.count * pct / 100))
+        running = 0
+        for index, bucket in enumerate(self.counts):
+            running += bucket
+            if running >= target:
+                return min(self.bucket_value(index), self.max_value) / 1000000
+        return self.max_value / 1000000
+
+    def mean(self):
+
+        if self.count == 0:
+            return 0.0
+        return (self.total / self.count) / 1000000
+
+    def ops_per_sec(self):
+
+        if self.count == 0 or self.last_end is None:
+            return 0.0
+        elapsed = self.last_end - self.first_start
+        if elapsed <= 0:
+            return 0.0
+        return self.count / elapsed
+
+    def bytes_per_sec(self):
+
+        if self.count == 0 or self.last_end is None:
+            return 0.0
+        elapsed = self.last_end - self.first_start
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes / elapsed
+
+    def summary(self):
+
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'ops_per_sec': self.ops_per_sec(),
+            'bytes_per_sec': self.bytes_per_sec(),
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p99.9': self.percentile(99.9),
+            'max': self.max_value / 1000000,
+        }
+
+class worker_counter:
+
+    __slots__ = ('ops', 'bytes', 'errors', 'inflight', 'lock')
+
+    def __init__(self):
+        self.ops = 0
+        self.bytes = 0
+        self.errors = 0
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def add_bytes(self, number):
+        with self.lock:
+            self.bytes += number
+
+class phase_body:
+
+    def __init__(self, body, callback):
+        self.body = body
+        self.callback = callback
+
+    def read(self, amt=None):
+        data = self.body.read(amt)
+        if self.callback is not None and (amt is None or not data):
+            self.callback()
+            self.callback = None
+        return data
+
+    def readinto(self, b):
+        amount = self.body.readinto(b)
+        if self.callback is not None and amount == 0:
+            self.callback()
+            self.callback = None
+        return amount
+
+    def __getattr__(self, name):
+        return getattr(self.body, name)
+
+class payload_reader:
+
+    # Each block of a seeded object starts with (seed << 32) + block number, so no two blocks repeat across objects
+    stamp_block = 4096
+
+    def __init__(self, buffer, size, offset=0, seed=None, origin=0):
+
+        self.buffer = buffer
+        self.view = buffer.view
+        self.period = buffer.size
+        self.size = size
+        self.base = offset % self.period
+        self.seed = seed
+        self.origin = origin
+        self.position = 0
+
+    def __len__(self):
+
+        return self.size
+
+    def read(self, amount=-1):
+
+        remaining = self.size - self.position
+        if amount is None or amount < 0 or amount > remaining:
+            amount = remaining
+        if amount <= 0:
+            return b''
+
+        data = self.chunk(self.position, amount)
+        self.position += amount
+        return data
+
+    def chunk(self, position, amount):
+
+        start = (self.base + position) % self.period
+        if amount <= self.period:
+            data = self.view[start:start + amount]
+        else:
+            chunks = []
+            needed = amount
+            while needed > 0:
+                length = min(needed, self.period)
+                chunks.append(self.view[start:start + length])
+                start = (start + length) % self.period
+                needed -= length
+            data = b''.join(chunks)
+
+        if self.seed is None:
+            return data
+
+        data = bytearray(data)
+        self.stamp(data, self.origin + position)
+        return data
+
+    def stamp(self, data, position):
+
+        tag = (self.seed & 0xffffffff) << 32
+        inside = position % self.stamp_block
+        if 0 < inside < 8:
+            # The read starts partway through a stamp, so finish the rest of it
+            head = array.array('Q', [tag + position // self.stamp_block]).tobytes()[inside:len(data) + inside]
+            data[0:len(head)] = head
+
+        first = -position % self.stamp_block
+        if first >= len(data):
+            return
+
+        block = (position + first) // self.stamp_block
+        count = len(range(first, len(data), self.stamp_block))
+        stamps = array.array('Q', range(tag + block, tag + block + count)).tobytes()
+        for n in range(8):
+            data[first + n::self.stamp_block] = stamps[n::8][:len(range(first + n, len(data), self.stamp_block))]
+
+    def part(self, offset, length):
+
+        return payload_reader(self.buffer, length, self.base + offset, self.seed, self.origin + offset)
+
+    def digest(self):
+
+        checksum = hashlib.md5()
+        position = 0
+        while position < self.size:
+            length = min(self.size - position, self.period)
+            checksum.update(self.chunk(position, length))
+            position += length
+
+        return checksum.hexdigest()
+
+    def seek(self, offset, whence=0):
+
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self.position + offset
+        elif whence == 2:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence %d" % whence)
+
+        self.position = min(max(position, 0), self.size)
+        return self.position
+
+    def tell(self):
+
+        return self.position
+
+    def seekable(self):
+
+        return True
+
+    def readable(self):
+
+        return True
+
+    def close(self):
+
+        return
+
+class key_tracker:
+
+    def __init__(self, numbers, next_number):
+
+        self.lock = threading.Lock()
+        self.keys = list(numbers)
+        self.index = {number: position for position, number in enumerate(self.keys)}
+        self.busy = {}
+        self.next_number = next_number
+
+    def __len__(self):
+
+        return len(self.keys)
+
+    def remove(self, number):
+
+        position = self.index.pop(number)
+        last = self.keys.pop()
+        if last != number:
+            self.keys[position] = last
+            self.index[last] = position
+
+    def acquire_read(self):
+
+        with self.lock:
+            if len(self.keys) == 0:
+                return None
+            number = random.choice(self.keys)
+            self.busy[number] = self.busy.get(number, 0) + 1
+            return number
+
+    def release_read(self, number):
+
+        with self.lock:
+            self.busy[number] -= 1
+            if self.busy[number] == 0:
+                del self.busy[number]
+
+    def acquire_delete(self, attempts=8):
+
+        with self.lock:
+            for attempt in range(attempts):
+                if len(self.keys) == 0:
+                    return None
+                number = random.choice(self.keys)
+                if number not in self.busy:
+                    self.remove(number)
+                    return number
+            return None
+
+    def reserve(self):
+
+        with self.lock:
+            number = self.next_number
+            self.next_number += 1
+            return number
+
+    def add(self, number):
+
+        with self.lock:
+            if number not in self.index:
+                self.index[number] = len(self.keys)
+                self.keys.append(number)
+
+class payload_buffer:
+
+    def __init__(self, size=16777216):
+
+        self.size = size
+        data = bytearray(os.urandom(size))
+        data.extend(data)
+        self.view = memoryview(data)
+
+    def reader(self, size, offset=0, seed=None):
+
+        return payload_reader(self, size, offset, seed)
+
+    def check(self):
+
+        # Object bytes must not depend on how a transfer splits its reads, so compare odd sized reads to digest()
+        reader = self.reader(5 * payload_reader.stamp_block + 1001, 4099, 1)
+        amounts = [1] * 12 + [4090, 3, 4099, 5, 4093, 7, 2]
+        checksum = hashlib.md5()
+        n = 0
+        while True:
+            data = reader.read(amounts[n % len(amounts)])
+            if not data:
+                break
+            checksum.update(data)
+            n += 1
+
+        return checksum.hexdigest() == reader.digest()
+
+class async_s3_client:
+
+    def __init__(self, endpoint, region, credentials, connect_timeout=60, read_timeout=60):
+
+        if endpoint is None:
+            endpoint = "https://s3.%s.amazonaws.com" % region
+        url = urllib.parse.urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.hostname = url.hostname
+        self.port = url.port
+        if self.port is None:
+            self.port = 443 if self.scheme == 'https' else 80
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip('/')
+        if self.port in (80, 443):
+            self.host_header = self.hostname
+        else:
+            self.host_header = "%s:%d" % (self.hostname, self.port)
+        if self.scheme == 'https':
+            self.ssl_context = ssl.create_default_context()
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        else:
+            self.ssl_context = None
+        self.signer = S3SigV4Auth(credentials, 's3', region)
+        self.sign_config = Config(s3={'payload_signing_enabled': False})
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle = []
+        self.opened = 0
+        self.requests = 0
+
+    async def connect(self, reuse=True):
+
+        if reuse and len(self.idle) > 0:
+            return self.idle.pop() + (True,)
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.hostname, self.port, ssl=self.ssl_context),
+                                                self.connect_timeout)
+        self.opened += 1
+        return reader, writer, False
+
+    def close(self):
+
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+    def sign(self, method, bucket, key, headers):
+
+        path = "%s/%s/%s" % (self.base_path, bucket, urllib.parse.quote(key))
+        request = AWSRequest(method=method, url="%s://%s%s" % (self.scheme, self.netloc, path), headers=headers)
+        request.context['client_config'] = self.sign_config
+        self.signer.add_auth(request)
+
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % self.host_header]
+        for name, value in request.headers.items():
+            lines.append("%s: %s" % (name, value))
+
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('ascii')
+
+    async def read_head(self, reader):
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        version, status = status_line.split()[0:2]
+        headers = {'version': version.decode('ascii')}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        return int(status), headers
+
+    async def read_body(self, reader, headers):
+
+        received = 0
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int((await asyncio.wait_for(reader.readline(), self.read_timeout)).split(b';')[0], 16)
+                if chunk_size == 0:
+                    await asyncio.wait_for(reader.readline(), self.read_timeout)
+                    break
+                remaining = chunk_size
+                while remaining > 0:
+                    data = await asyncio.wait_for(reader.read(min(remaining, 1048576)), self.read_timeout)
+                    if not data:
+                        raise asyncio.IncompleteReadError(b'', remaining)
+                    remaining -= len(data)
+                received += chunk_size
+                await asyncio.wait_for(reader.readline(), self.read_timeout)
+        else:
+            remaining = int(headers.get('content-length', 0))
+            while remaining > 0:
+                data = await asyncio.wait_for(reader.read(min(remaining, 1048576)), self.read_timeout)
+                if not data:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                remaining -= len(data)
+                received += len(data)
+
+        return received
+
+    async def send(self, reader, writer, head, body):
+
+        writer.write(head)
+        if body is not None:
+            while True:
+                chunk = body.read(1048576)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), self.read_timeout)
+        await asyncio.wait_for(writer.drain(), self.read_timeout)
+
+        return await asyncio.wait_for(self.read_head(reader), self.read_timeout)
+
+    async def request(self, method, bucket, key, body=None, length=0):
+
+        headers = {}
+        if method == 'PUT':
+            headers['Content-Length'] = str(length)
+        head = self.sign(method, bucket, key, headers)
+
+        reader, writer, reused = await self.connect()
+        try:
+            try:
+                status, response_headers = await self.send(reader, writer, head, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                writer.close()
+                if body is not None:
+                    body.seek(0)
+                reader, writer, reused = await self.connect(reuse=False)
+                status, response_headers = await self.send(reader, writer, head, body)
+            if method == 'HEAD':
+                received = 0
+            else:
+                received = await self.read_body(reader, response_headers)
+        except Exception:
+            writer.close()
+            raise
+
+        self.requests += 1
+        connection = response_headers.get('connection', '').lower()
+        if connection == 'close' or (response_headers['version'] == 'HTTP/1.0' and connection != 'keep-alive'):
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+
+        return status, received
+
+DELETE_BATCH_SIZE = 1000
+RESULT_VERSION = 1
+MANIFEST_HEADER = "#s3test-manifest"
+PHASE_OPS = {'GetObject': 'GET', 'PutObject': 'PUT', 'HeadObject': 'HEAD', 'DeleteObject': 'DELETE', 'DeleteObjects': 'BULKDEL',
+             'ListObjectsV2': 'LIST', 'UploadPart': 'PART', 'CopyObject': 'COPY',
+             'PutObjectTagging': 'PUTTAG', 'GetObjectTagging': 'GETTAG', 'CreateMultipartUpload': 'MPU-CREATE', 'CompleteMultipartUpload': 'MPU-COMPLETE'}
+PHASES = ('build', 'sign', 'connect+ttfb', 'ttfb', 'body')
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests', 'RequestThrottled')
+ERROR_PRINT_LIMIT = 10
+
+class operation_error(Exception):
+
+    def __init__(self, op, code, message):
+        super().__init__(message)
+        self.op = op
+        self.code = code
+
+class operation_skipped(Exception):
+
+    def __init__(self, op):
+        super().__init__(op)
+        self.op = op
+
+def error_code(e):
+
+    cause = e
+    while cause is not None:
+        if isinstance(cause, ClientError):
+            status = cause.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            code = cause.response.get('Error', {}).get('Code', 'Unknown')
+            if status is None or code == str(status):
+                return code
+            return "%d %s" % (status, code)
+        cause = cause.__cause__ or cause.__context__
+
+    return type(e).__name__
+
+def throttled(code):
+
+    return code.split(' ')[0] in ('503', '429') or code.split(' ')[-1] in THROTTLE_CODES
+
+MODEL_T95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+             15: 2.131, 20: 2.086, 30: 2.042, 60: 2.000, 120: 1.980}
+METADATA_OPS = ('exists', 'copy', 'put-tag', 'get-tag', 'put-empty')
+DISTRIBUTED_OPS = ('put', 'get', 'head', 'delete') + METADATA_OPS
+MIXED_OPS = ('get', 'put', 'head', 'delete', 'list')
+
+class connection_counter:
+
+    def __init__(self):
+
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def install(self):
+
+        # Every new or re-established HTTP and HTTPS connection opens its socket through _new_conn
+        new_conn = urllib3.connection.HTTPConnection._new_conn
+        if getattr(new_conn, 'counted', False):
+            return
+
+        def counted_new_conn(connection):
+            sock = new_conn(connection)
+            self.count()
+            return sock
+
+        counted_new_conn.counted = True
+        urllib3.connection.HTTPConnection._new_conn = counted_new_conn
+
+    def count(self):
+
+        with self.lock:
+            self.opened += 1
+        self.local.opened = getattr(self.local, 'opened', 0) + 1
+
+    def thread_opened(self):
+
+        return getattr(self.local, 'opened', 0)
+
+    def reset(self):
+
+        self.opened = 0
+
+connection_log = connection_counter()
+
 class parse_args:
 
     def __init__(self):
 
-        self.arglist = []
+        self.arglist = ['pool=', 'keepalive', 'connect-timeout=', 'read-timeout=', 'unique', 'payload-buffer=', 'processes=', 'engine=', 'inflight=', 'agent-listen=', 'agents=', 'agent-token=', 'single-delete', 'list-shards', 'rate=', 'mix=', 'duration=', 'seed=', 'key-dist=', 'keys=', 'hash-keys', 'multipart-threshold=', 'part-size=',
+                        'part-concurrency=', 'explicit-multipart', 'range-size=', 'range-offsets=', 'range-key=',
+                        'model-reps=', 'model-warmup=', 'model-max=', 'model-p99=', 'series=', 'phases', 'on-error=',
+                        'sink-buffer=', 'verify', 'result=', 'manifest=', 'loopback=']
         self.bucketName = None
         self.awsProfile = None
         self.dataSize = 65536
+        self.sizeSpec = '65536'
+        self.randomSeed = 1
+        self.keyDistSpec = 'sequential'
+        self.keyCount = None
+        self.hashKeys = False
+        self.multipartThreshold = 8388608
+        self.partSize = 8388608
+        self.partConcurrency = 10
+        self.explicitMultipart = False
+        self.rangeSize = 1048576
+        self.rangeOffsets = 'random'
+        self.rangeKey = None
+        self.modelReps = 3
+        self.modelWarmup = 1
+        self.modelMax = 0
+        self.modelP99 = 0.0
+        self.seriesFile = None
+        self.phaseTiming = False
+        self.errorPolicy = 'stop'
+        self.sinkBuffer = 1048576
+        self.verifyData = False
+        self.resultFile = None
+        self.manifestFile = None
+        self.loopbackMode = None
         self.endPoint = None
         self.verboseFlag = False
         self.modelFlag = False
@@ -73,6 +1018,23 @@ class parse_args:
         self.filePrefix = 'objdata'
         self.opType = 'put'
         self.destDir = '/dev/null'
+        self.poolConnections = 10
+        self.tcpKeepalive = False
+        self.connectTimeout = 60
+        self.readTimeout = 60
+        self.uniqueData = False
+        self.payloadSize = 16777216
+        self.processCount = 1
+        self.engine = 'thread'
+        self.inflightCount = 64
+        self.agentListen = None
+        self.agentList = []
+        self.agentToken = os.environ.get('S3TEST_AGENT_TOKEN')
+        self.singleDelete = False
+        self.listShards = False
+        self.requestRate = 0
+        self.opMix = {'get': 70, 'put': 20, 'head': 5, 'delete': 5}
+        self.runDuration = 60
         self.argCount = 0
 
     def parse(self):
@@ -86,9 +1048,10 @@ class parse_args:
                 self.awsProfile = arg
             elif opt in ('-s', '--size'):
                 try:
-                    self.dataSize = int(arg)
-                except ValueError as e:
-                    print("Size must be a number.")
+                    self.dataSize = int(size_distribution(arg).mean())
+                    self.sizeSpec = arg
+                except (ValueError, IndexError) as e:
+                    print("Size must be a number or a size distribution: %s" % str(e))
                     sys.exit(1)
             elif opt in ('-e', '--endpoint'):
                 self.endPoint = arg
@@ -118,44 +1081,330 @@ class parse_args:
                 else:
                     print("Directory %s does not exist." % arg)
                     sys.exit(1)
-            elif opt in ('-h', '--help'):
-                usage()
-                sys.exit(0)
-            else:
-                usage()
-                sys.exit(1)
-
-class tester:
-
-    def __init__(self, args):
-
-        self.token = args
-        self.bucketName = self.token.bucketName
-        self.verboseFlag = self.token.verboseFlag
-        self.opType = self.token.opType
-        self.opCount = self.token.opCount
-        self.filePrefix = self.token.filePrefix
-        self.dataSize = self.token.dataSize
-        self.endPoint = self.token.endPoint
-        self.awsProfile = self.token.awsProfile
+            elif opt == '--pool':
+                try:
+                    self.poolConnections = int(arg)
+                except ValueError as e:
+                    print("Pool connections must be a number.")
+                    sys.exit(1)
+            elif opt == '--keepalive':
+                self.tcpKeepalive = True
+            elif opt == '--connect-timeout':
+                try:
+                    self.connectTimeout = float(arg)
+                except ValueError as e:
+                    print("Connect timeout must be a number.")
+                    sys.exit(1)
+            elif opt == '--read-timeout':
+                try:
+                    self.readTimeout = float(arg)
+                except ValueError as e:
+                    print("Read timeout must be a number.")
+                    sys.exit(1)
+            elif opt == '--unique':
+                self.uniqueData = True
+            elif opt == '--payload-buffer':
+                try:
+                    self.payloadSize = parse_size(arg)
+                except ValueError as e:
+                    print("Payload buffer must be a size: %s" % str(e))
+                    sys.exit(1)
+                if self.payloadSize <= 0:
+                    print("Payload buffer size must be greater than zero.")
+                    sys.exit(1)
+            elif opt == '--processes':
+                try:
+                    self.processCount = int(arg)
+                except ValueError as e:
+                    print("Processes must be a number.")
+                    sys.exit(1)
+                if self.processCount < 1:
+                    print("Processes must be at least 1.")
+                    sys.exit(1)
+            elif opt == '--engine':
+                if arg in ('thread', 'async'):
+                    self.engine = arg
+                else:
+                    print("Engine must be one of thread or async.")
+                    sys.exit(1)
+            elif opt == '--inflight':
+                try:
+                    self.inflightCount = int(arg)
+                except ValueError as e:
+                    print("In-flight limit must be a number.")
+                    sys.exit(1)
+                if self.inflightCount < 1:
+                    print("In-flight limit must be at least 1.")
+                    sys.exit(1)
+            elif opt == '--agent-listen':
+                self.agentListen = parse_address(arg, '127.0.0.1')
+            elif opt == '--agents':
+                self.agentList = [parse_address(agent, None) for agent in arg.split(',') if len(agent) > 0]
+            elif opt == '--agent-token':
+                self.agentToken = arg
+            elif opt == '--single-delete':
+                self.singleDelete = True
+            elif opt == '--list-shards':
+                self.listShards = True
+            elif opt == '--rate':
+                try:
+                    self.requestRate = float(arg)
+                except ValueError as e:
+                    print("Rate must be a number.")
+                    sys.exit(1)
+                if self.requestRate < 0:
+                    print("Rate can not be negative.")
+                    sys.exit(1)
+            elif opt == '--mix':
+                self.opMix = parse_mix(arg)
+            elif opt == '--duration':
+                try:
+                    self.runDuration = float(arg)
+                except ValueError as e:
+                    print("Duration must be a number.")
+                    sys.exit(1)
+                if self.runDuration <= 0:
+                    print("Duration must be greater than zero.")
+                    sys.exit(1)
+            elif opt == '--seed':
+                try:
+                    self.randomSeed = int(arg)
+                except ValueError as e:
+                    print("Seed must be a number.")
+                    sys.exit(1)
+            elif opt == '--key-dist':
+                try:
+                    key_distribution(arg, 1)
+                except ValueError as e:
+                    print("Key distribution must be sequential, uniform, zipf[:exponent] or hotspot[:keys,share]: %s" % str(e))
+                    sys.exit(1)
+                self.keyDistSpec = arg
+            elif opt == '--keys':
+                try:
+                    self.keyCount = int(arg)
+                except ValueError as e:
+                    print("Keys must be a number.")
+                    sys.exit(1)
+            elif opt == '--hash-keys':
+                self.hashKeys = True
+            elif opt in ('--multipart-threshold', '--part-size'):
+                try:
+                    value = parse_size(arg)
+                except ValueError as e:
+                    print("%s must be a size: %s" % (opt, str(e)))
+                    sys.exit(1)
+                if value < 5242880:
+                    print("%s must be at least 5MiB." % opt)
+                    sys.exit(1)
+                if opt == '--part-size':
+                    self.partSize = value
+                else:
+                    self.multipartThreshold = value
+            elif opt == '--part-concurrency':
+                try:
+                    self.partConcurrency = int(arg)
+                except ValueError as e:
+                    print("Part concurrency must be a number.")
+                    sys.exit(1)
+                if self.partConcurrency < 1:
+                    print("Part concurrency must be at least 1.")
+                    sys.exit(1)
+            elif opt == '--explicit-multipart':
+                self.explicitMultipart = True
+            elif opt == '--range-size':
+                try:
+                    self.rangeSize = parse_size(arg)
+                except ValueError as e:
+                    print("Range size must be a size: %s" % str(e))
+                    sys.exit(1)
+                if self.rangeSize < 1:
+                    print("Range size must be at least 1 byte.")
+                    sys.exit(1)
+            elif opt == '--range-offsets':
+                if arg in ('random', 'sequential'):
+                    self.rangeOffsets = arg
+                else:
+                    print("Range offsets must be random or sequential.")
+                    sys.exit(1)
+            elif opt == '--range-key':
+                self.rangeKey = arg
+            elif opt == '--model-reps':
+                try:
+                    self.modelReps = int(arg)
+                except ValueError as e:
+                    print("Model repetitions must be a number.")
+                    sys.exit(1)
+                if self.modelReps < 1:
+                    print("Model repetitions must be at least 1.")
+                    sys.exit(1)
+            elif opt == '--model-warmup':
+                try:
+                    self.modelWarmup = int(arg)
+                except ValueError as e:
+                    print("Model warmup must be a number.")
+                    sys.exit(1)
+            elif opt == '--model-max':
+                try:
+                    self.modelMax = int(arg)
+                except ValueError as e:
+                    print("Model maximum threads must be a number.")
+                    sys.exit(1)
+            elif opt == '--sink-buffer':
+                try:
+                    self.sinkBuffer = parse_size(arg)
+                except ValueError as e:
+                    print("Sink buffer must be a size: %s" % str(e))
+                    sys.exit(1)
+                if self.sinkBuffer < 4096:
+                    print("Sink buffer must be at least 4KiB.")
+                    sys.exit(1)
+            elif opt == '--verify':
+                self.verifyData = True
+            elif opt == '--result':
+                self.resultFile = arg
+            elif opt == '--manifest':
+                self.manifestFile = arg
+            elif opt == '--loopback':
+                if arg in ('discard', 'memory'):
+                    self.loopbackMode = arg
+                else:
+                    print("Loopback mode must be discard or memory.")
+                    sys.exit(1)
+            elif opt == '--on-error':
+                if arg in ('stop', 'continue'):
+                    self.errorPolicy = arg
+                else:
+                    print("Error policy must be stop or continue.")
+                    sys.exit(1)
+            elif opt == '--phases':
+                self.phaseTiming = True
+            elif opt == '--series':
+                self.seriesFile = arg
+            elif opt == '--model-p99':
+                try:
+                    self.modelP99 = float(arg)
+                except ValueError as e:
+                    print("Model p99 ceiling must be a number of milliseconds.")
+                    sys.exit(1)
+            elif opt in ('-h', '--help'):
+                usage()
+                sys.exit(0)
+            else:
+                usage()
+                sys.exit(1)
+
+class tester:
+
+    def __init__(self, args):
+
+        self.token = args
+        self.bucketName = self.token.bucketName
+        self.verboseFlag = self.token.verboseFlag
+        self.opType = self.token.opType
+        self.opCount = self.token.opCount
+        self.filePrefix = self.token.filePrefix
+        self.dataSize = self.token.dataSize
+        self.sizeDist = size_distribution(self.token.sizeSpec)
+        self.randomSeed = self.token.randomSeed
+        self.hashKeys = self.token.hashKeys
+        self.keyDist = key_distribution(self.token.keyDistSpec, self.token.keyCount or self.token.opCount)
+        self.key_hits = collections.Counter()
+        self.multipartThreshold = self.token.multipartThreshold
+        self.partSize = self.token.partSize
+        self.partConcurrency = self.token.partConcurrency
+        self.explicitMultipart = self.token.explicitMultipart
+        self.rangeSize = self.token.rangeSize
+        self.rangeOffsets = self.token.rangeOffsets
+        self.rangeKey = self.token.rangeKey
+        self.modelReps = self.token.modelReps
+        self.modelWarmup = self.token.modelWarmup
+        self.modelMax = self.token.modelMax
+        self.modelP99 = self.token.modelP99
+        self.seriesFile = self.token.seriesFile
+        self.phaseTiming = self.token.phaseTiming
+        self.errorPolicy = self.token.errorPolicy
+        self.sinkBuffer = self.token.sinkBuffer
+        self.verifyData = self.token.verifyData
+        self.resultFile = self.token.resultFile
+        self.manifestFile = self.token.manifestFile
+        self.loopbackMode = self.token.loopbackMode
+        self.manifest_out = None
+        self.manifest_lock = threading.Lock()
+        self.manifest_sums = None
+        self.transferConfig = TransferConfig(
+            multipart_threshold=self.multipartThreshold,
+            multipart_chunksize=self.partSize,
+            max_concurrency=self.partConcurrency
+        )
+        self.endPoint = self.token.endPoint
+        self.awsProfile = self.token.awsProfile
         self.destDir = self.token.destDir
         self.threadCount = self.token.threadCount
+        self.uniqueData = self.token.uniqueData
+        self.payloadSize = self.token.payloadSize
+        self.payload = None
+        self.processCount = self.token.processCount
+        self.engine = self.token.engine
+        self.inflightCount = self.token.inflightCount
+        self.singleDelete = self.token.singleDelete
+        self.delete_errors = 0
+        self.delete_count = 0
+        self.listShards = self.token.listShards
+        self.requestRate = self.token.requestRate
+        self.opMix = self.token.opMix
+        self.runDuration = self.token.runDuration
+        self.run_until = None
+        self.stop_run = False
+        self.verify_counts = collections.Counter()
+        self.exists_counts = collections.Counter()
+        self.failures = collections.Counter()
+        self.mix_skips = collections.Counter()
+        self.shared_histograms = {}
+        self.shared_requests = collections.Counter()
+        self.worker_requests = [self.shared_requests]
+        self.live_keys = None
+        self.list_numbers = None
+        self.list_limit = None
+        self.object_sizes = None
+        self.list_keys = 0
+        self.list_pages = 0
+        self.list_elapsed = 0
+        self.list_error = False
+        self.keyStart = 0
+        self.statusFlag = True
+        self.skipList = False
+        self.progressCounter = None
+        self.remote_connections = [0, 0]
         self.percentage = 0
         self.xfer_total = 0
         self.xfer_progress = 0
         self.current_file = 0
         self.last_file = 0
         self.status_thread_run = 1
+        self.counter_lock = threading.Lock()
+        self.client_lock = threading.Lock()
+        self.thread_local = threading.local()
+        self.thread_clients = []
+        self.worker_histograms = [self.shared_histograms]
+        self.worker_counters = []
+        self.time_series = []
+        self.series_start = None
         self.start_time = datetime.datetime.now().replace(microsecond=0)
         self.end_time = datetime.datetime.now().replace(microsecond=0)
         self.awsConfig = Config(
             retries={
                 'max_attempts': 5,
                 'mode': 'standard'
-            }
+            },
+            max_pool_connections=self.token.poolConnections,
+            tcp_keepalive=self.token.tcpKeepalive,
+            connect_timeout=self.token.connectTimeout,
+            read_timeout=self.token.readTimeout
         )
         try:
-            if self.awsProfile:
+            if self.loopbackMode is not None:
+                self.s3session = boto3.Session(aws_access_key_id='loopback', aws_secret_access_key='loopback', region_name='us-east-1')
+            elif self.awsProfile:
                 self.s3session = boto3.Session(profile_name=self.awsProfile,)
             else:
                 self.s3session = boto3.Session(profile_name="default",)
@@ -163,447 +1412,2778 @@ class tester:
             print("Error: %s" % str(e))
             sys.exit(1)
         self.s3 = self.s3session.client('s3', endpoint_url=self.endPoint, verify=False, config=self.awsConfig)
+        self.register_hooks(self.s3)
+        self.cpu_start = self.cpu_seconds()
+        connection_log.install()
+        connection_log.reset()
 
     def register_start(self):
 
-        self.start_time = datetime.datetime.now().replace(microsecond=0)
-        print("Start at %s" % self.start_time.strftime("%m/%d/%y %I:%M%p"))
+        self.start_time = datetime.datetime.now().replace(microsecond=0)
+        print("Start at %s" % self.start_time.strftime("%m/%d/%y %I:%M%p"))
+
+    def register_end(self):
+
+        self.end_time = datetime.datetime.now().replace(microsecond=0)
+        print("End at %s" % self.end_time.strftime("%m/%d/%y %I:%M%p"))
+        print("Run time: ", end='')
+        print(self.end_time - self.start_time)
+        self.print_connection_stats()
+
+    def get_thread_client(self):
+
+        thread_s3 = getattr(self.thread_local, 's3', None)
+        if thread_s3 is None:
+            with self.client_lock:
+                thread_s3 = self.s3session.client('s3', endpoint_url=self.endPoint, verify=False, config=self.awsConfig)
+                self.thread_clients.append(thread_s3)
+            self.register_hooks(thread_s3)
+            self.thread_local.s3 = thread_s3
+
+        return thread_s3
+
+    def register_hooks(self, client):
+
+        events = client.meta.events
+        events.register('before-call.s3', self.count_call)
+        events.register('response-received.s3', self.count_attempt)
+
+        if not self.phaseTiming:
+            return
+
+        events.register('before-call.s3', self.phase_call)
+        events.register('before-sign.s3', self.phase_sign)
+        events.register('before-send.s3', self.phase_send)
+        events.register('before-parse.s3', self.phase_headers)
+        events.register('after-call.s3.GetObject', self.phase_response)
+
+    def request_counts(self):
+
+        counts = getattr(self.thread_local, 'requests', None)
+        if counts is None:
+            # s3transfer and part threads are short-lived, so only pool workers get their own counter
+            if not getattr(self.thread_local, 'pooled', False):
+                return None
+            counts = collections.Counter()
+            self.thread_local.requests = counts
+            with self.counter_lock:
+                self.worker_requests.append(counts)
+
+        return counts
+
+    def count_request(self, key):
+
+        counts = self.request_counts()
+        if counts is None:
+            with self.counter_lock:
+                self.shared_requests[key] += 1
+        else:
+            counts[key] += 1
+
+    def request_op(self, event_name):
+
+        operation = event_name.split('.')[-1]
+        if operation == 'HeadObject' and self.opType == 'exists':
+            return 'EXISTS'
+
+        return PHASE_OPS.get(operation, operation)
+
+    def count_call(self, event_name, **kwargs):
+
+        self.count_request((self.request_op(event_name), 'calls'))
+
+    def count_attempt(self, event_name, response_dict=None, parsed_response=None, exception=None, **kwargs):
+
+        op = self.request_op(event_name)
+        self.count_request((op, 'attempts'))
+
+        if exception is not None:
+            self.count_request((op, type(exception).__name__))
+        elif response_dict is not None and response_dict['status_code'] >= 300:
+            status = response_dict['status_code']
+            if op == 'EXISTS' and status == 404:
+                # A missing object is an answer for exists, not an error
+                return
+            code = (parsed_response or {}).get('Error', {}).get('Code', str(status))
+            self.count_request((op, code if code == str(status) else "%d %s" % (status, code)))
+
+    def record_failure(self, e):
+
+        with self.counter_lock:
+            self.failures[(e.op, e.code)] += 1
+            failures = sum(self.failures.values())
+            if self.errorPolicy == 'stop':
+                self.stop_run = True
+
+        if self.errorPolicy == 'stop' or failures <= ERROR_PRINT_LIMIT:
+            sys.stdout.write("\r%s\033[K\n" % str(e))
+        if self.errorPolicy == 'continue' and failures == ERROR_PRINT_LIMIT:
+            print("Further errors are counted but not printed.")
+
+    def merged_request_counts(self):
+
+        merged = collections.Counter()
+        with self.counter_lock:
+            for counts in self.worker_requests:
+                merged.update(counts)
+
+        return merged
+
+    def print_error_stats(self):
+
+        counts = self.merged_request_counts()
+        codes = [key for key in counts if key[1] not in ('calls', 'attempts')]
+        if len(codes) == 0 and len(self.failures) == 0:
+            return
+
+        ops = sorted(set(op for op, name in counts) | set(op for op, code in self.failures), key=report_order)
+        width = max(8, max(len(op) for op in ops))
+        print("Requests (retries and throttles counted per attempt, failed counts operations that gave up):")
+        print("%-*s %10s %10s %10s %10s %10s" % (width, "Op", "Calls", "Attempts", "Retries", "Throttled", "Failed"))
+        for op in ops:
+            calls = counts[(op, 'calls')]
+            attempts = counts[(op, 'attempts')]
+            throttles = sum(counts[key] for key in codes if key[0] == op and throttled(key[1]))
+            failed = sum(n for (name, code), n in self.failures.items() if name == op)
+            print("%-*s %10d %10d %10d %10d %10d" % (width, op, calls, attempts, max(0, attempts - calls), throttles, failed))
+            for key in sorted(key for key in codes if key[0] == op):
+                print("%-*s   %s: %d attempts" % (width, "", key[1], counts[key]))
+            for code in sorted(code for name, code in self.failures if name == op):
+                print("%-*s   %s: %d failed" % (width, "", code, self.failures[(op, code)]))
+
+        overall = self.overall_latency(self.merged_latency_stats())
+        elapsed = overall.last_end - overall.first_start if overall.count > 0 else 0
+        if elapsed > 0:
+            attempts = sum(counts[key] for key in counts if key[1] == 'attempts')
+            print("Goodput %.1f ops/sec (%s/s), attempted %.1f requests/sec with %d failed operations" %
+                  (overall.count / elapsed, formatSize(overall.bytes / elapsed), attempts / elapsed, sum(self.failures.values())))
+
+    def phase_call(self, event_name, **kwargs):
+
+        self.thread_local.phase_op = self.request_op(event_name)
+        self.thread_local.phase_mark = time.perf_counter()
+
+    def phase_sign(self, **kwargs):
+
+        now = time.perf_counter()
+        mark = getattr(self.thread_local, 'phase_mark', None)
+        if mark is not None:
+            self.record_phase('build', mark, now)
+        self.thread_local.phase_mark = now
+
+    def phase_send(self, **kwargs):
+
+        now = time.perf_counter()
+        mark = getattr(self.thread_local, 'phase_mark', None)
+        if mark is not None:
+            self.record_phase('sign', mark, now)
+        self.thread_local.phase_mark = now
+        self.thread_local.phase_opened = connection_log.thread_opened()
+
+    def phase_headers(self, **kwargs):
+
+        now = time.perf_counter()
+        mark = getattr(self.thread_local, 'phase_mark', None)
+        if mark is not None:
+            if connection_log.thread_opened() > self.thread_local.phase_opened:
+                self.record_phase('connect+ttfb', mark, now)
+            else:
+                self.record_phase('ttfb', mark, now)
+        self.thread_local.phase_mark = None
+        self.thread_local.phase_headers = now
+
+    def phase_response(self, parsed, **kwargs):
+
+        if 'Body' not in parsed:
+            return
+
+        op = self.thread_local.phase_op
+        headers = self.thread_local.phase_headers
+
+        def body_done():
+            self.record_phase('body', headers, time.perf_counter(), op)
+
+        parsed['Body'] = phase_body(parsed['Body'], body_done)
+
+    def record_phase(self, phase, start, end, op=None):
+
+        if op is None:
+            op = getattr(self.thread_local, 'phase_op', None)
+        if op is None:
+            return
+
+        self.record_histogram(op + '/' + phase, start, end)
+
+    def connection_stats(self):
+
+        opened, requests = self.remote_connections
+        opened += connection_log.opened
+
+        for client in [self.s3] + self.thread_clients:
+            try:
+                pools = client._endpoint.http_session._manager.pools
+            except AttributeError:
+                continue
+            for pool_key in pools.keys():
+                requests += pools[pool_key].num_requests
+
+        return opened, requests
+
+    def object_name(self, number):
+
+        name = self.filePrefix + '-' + str(number)
+        if self.hashKeys:
+            return key_hash(name) + '-' + name
+
+        return name
+
+    def key_number(self, key):
+
+        if self.hashKeys:
+            if len(key) < 6 or key[4] != '-':
+                return None
+            name = key[5:]
+        else:
+            name = key
+
+        if not name.startswith(self.filePrefix + '-'):
+            return None
+        number = name[len(self.filePrefix) + 1:]
+        if not number.isdigit():
+            return None
+        if self.hashKeys and key[:4] != key_hash(name):
+            return None
+
+        return int(number)
+
+    def get_key_numbers(self, count):
+
+        if self.keyDist.sequential():
+            for x in range(self.keyStart, self.keyStart + count):
+                yield x + 1
+            return
+
+        rng = random.Random((self.randomSeed * 1000003) + self.keyStart)
+        for x in range(count):
+            number = self.keyDist.sample(rng)
+            self.key_hits[number] += 1
+            yield number
+
+    def print_key_spread(self):
+
+        if len(self.key_hits) == 0:
+            return
+
+        requests = sum(self.key_hits.values())
+        ranked = sorted(self.key_hits.values(), reverse=True)
+        top_count = max(1, self.keyDist.key_count // 100)
+        top_share = sum(ranked[:top_count]) / requests * 100
+        hottest, hits = self.key_hits.most_common(1)[0]
+        print("Key access (%s): %d requests over %d of %d keys, top 1%% of keys took %.1f%% of requests, hottest key %s with %d hits" %
+              (str(self.keyDist), requests, len(self.key_hits), self.keyDist.key_count, top_share, self.object_name(hottest), hits))
+
+    def object_size(self, number):
+
+        if self.sizeDist.fixed():
+            return self.sizeDist.size
+
+        return self.sizeDist.sample(random.Random((self.randomSeed * 1000003) + number))
+
+    def expected_size(self, count):
+
+        if self.sizeDist.fixed():
+            return count * self.sizeDist.size
+
+        return int(count * self.sizeDist.mean())
+
+    def record_transfer(self, op, start, end, size):
+
+        self.record_latency(op, start, end, size)
+        if not self.sizeDist.fixed():
+            self.record_latency(op + ' ' + size_class(size), start, end, size)
+
+    def record_latency(self, op, start, end, size=0):
+
+        intended = getattr(self.thread_local, 'intended_start', None)
+        if intended is not None and intended < start:
+            start = intended
+
+        self.record_histogram(op, start, end, size)
+
+    def record_histogram(self, op, start, end, size=0):
+
+        if getattr(self.thread_local, 'pooled', False):
+            self.thread_histogram(op).record(start, end, size)
+            return
+
+        # Phase hooks and part uploads run on short-lived threads, record those under the lock
+        with self.counter_lock:
+            if op not in self.shared_histograms:
+                self.shared_histograms[op] = latency_histogram()
+            self.shared_histograms[op].record(start, end, size)
+
+    def thread_histogram(self, op):
+
+        histograms = getattr(self.thread_local, 'histograms', None)
+        if histograms is None:
+            histograms = {}
+            self.thread_local.histograms = histograms
+            with self.counter_lock:
+                self.worker_histograms.append(histograms)
+        if op not in histograms:
+            histograms[op] = latency_histogram()
+
+        return histograms[op]
+
+    def reset_latency_stats(self):
+
+        with self.counter_lock:
+            self.shared_histograms = {}
+            self.worker_histograms = [self.shared_histograms]
+        self.thread_local = threading.local()
+
+    def merged_latency_stats(self):
+
+        merged = {}
+        with self.counter_lock:
+            for histograms in self.worker_histograms:
+                for op in histograms:
+                    if op not in merged:
+                        merged[op] = latency_histogram()
+                    merged[op].merge(histograms[op])
+
+        return merged
+
+    def print_latency_stats(self):
+
+        merged = self.merged_latency_stats()
+        if len(merged) == 0:
+            return
+
+        phases = {op: merged.pop(op) for op in list(merged) if '/' in op}
+        if len(merged) == 0:
+            # No operation completed, so only request phases were recorded
+            self.print_phase_stats(phases)
+            return
+
+        if self.requestRate > 0:
+            achieved = self.overall_latency(merged).ops_per_sec()
+            print("Offered rate %.1f ops/sec, achieved %.1f ops/sec (latency measured from intended start)" % (self.requestRate, achieved))
+
+        width = max(8, max(len(op) for op in merged))
+        print("%-*s %10s %10s %12s %10s %10s %10s %10s %10s" % (width, "Op", "Count", "Ops/sec", "Throughput", "p50", "p90", "p99", "p99.9", "Max"))
+        for op in sorted(merged, key=report_order):
+            stats = merged[op]
+            if stats.bytes > 0:
+                throughput = formatSize(stats.bytes_per_sec()) + "/s"
+            else:
+                throughput = "-"
+            print("%-*s %10d %10.1f %12s %10s %10s %10s %10s %10s" % (width, op, stats.count, stats.ops_per_sec(), throughput,
+                                                                      formatLatency(stats.percentile(50)),
+                                                                      formatLatency(stats.percentile(90)),
+                                                                      formatLatency(stats.percentile(99)),
+                                                                      formatLatency(stats.percentile(99.9)),
+                                                                      formatLatency(stats.max_value / 1000000)))
+
+        if len(phases) > 0:
+            self.print_phase_stats(phases)
+
+    def print_phase_stats(self, phases):
+
+        print("Request phases (build: client call setup, sign: signing and request preparation, ttfb: send to response headers, body: headers to end of body):")
+        ops = sorted(set(name.split('/')[0] for name in phases), key=report_order)
+        width = max(8, max(len(op) for op in ops))
+        print("%-*s %-12s %10s %10s %10s %10s %10s %10s" % (width, "Op", "Phase", "Count", "Mean", "p50", "p90", "p99", "Max"))
+        for op in ops:
+            for phase in PHASES:
+                stats = phases.get(op + '/' + phase)
+                if stats is None:
+                    continue
+                print("%-*s %-12s %10d %10s %10s %10s %10s %10s" % (width, op, phase, stats.count, formatLatency(stats.mean()),
+                                                                 formatLatency(stats.percentile(50)),
+                                                                 formatLatency(stats.percentile(90)),
+                                                                 formatLatency(stats.percentile(99)),
+                                                                 formatLatency(stats.max_value / 1000000)))
+
+    def overall_latency(self, merged):
+
+        overall = latency_histogram()
+        for op in merged:
+            if ' ' not in op and '/' not in op:
+                overall.merge(merged[op])
+
+        return overall
+
+    def print_connection_stats(self):
+
+        opened, requests = self.connection_stats()
+        reused = max(0, requests - opened)
+        print("Connections: %d opened, %d reused, %d requests" % (opened, reused, requests))
+
+    def status_callback(self, number):
+
+        if self.last_file == self.current_file:
+            return
+
+        self.percentage += (1 / self.opCount) * 100
+        self.last_file = self.current_file
+
+        print("File %d of %d in progress, %d%% completed ... " % (self.current_file, self.opCount, self.percentage), end='\r')
+
+    def thread_status_callback(self, number):
+
+        self.thread_counter().add_bytes(number)
+
+    def transfer_callback(self):
+
+        # Transfer callbacks run on s3transfer and part threads that come and go with
+        # each call, so bind them to the calling pool worker's counter up front.
+        return self.thread_counter().add_bytes
+
+    def thread_counter(self):
+
+        counter = getattr(self.thread_local, 'counter', None)
+        if counter is None:
+            counter = worker_counter()
+            self.thread_local.counter = counter
+            with self.counter_lock:
+                self.worker_counters.append(counter)
+
+        return counter
+
+    def counter_totals(self):
+
+        totals = worker_counter()
+        with self.counter_lock:
+            counters = list(self.worker_counters)
+        for counter in counters:
+            totals.ops += counter.ops
+            totals.bytes += counter.bytes
+            totals.errors += counter.errors
+            totals.inflight += counter.inflight
+
+        return totals
+
+    def transferred(self):
+
+        return self.xfer_progress + self.counter_totals().bytes
+
+    def sample_counters(self, last, last_time):
+
+        now = time.perf_counter()
+        totals = self.counter_totals()
+        elapsed = now - last_time
+        if self.series_start is None:
+            self.series_start = last_time
+        sample = {
+            'time': round(now - self.series_start, 3),
+            'ops_per_sec': (totals.ops - last.ops) / elapsed,
+            'bytes_per_sec': (totals.bytes - last.bytes) / elapsed,
+            'errors_per_sec': (totals.errors - last.errors) / elapsed,
+            'inflight': totals.inflight
+        }
+        self.time_series.append(sample)
+
+        return sample, totals, now
+
+    def write_time_series(self):
+
+        if self.seriesFile is None:
+            return
+
+        fields = ('time', 'ops_per_sec', 'bytes_per_sec', 'errors_per_sec', 'inflight')
+        try:
+            with open(self.seriesFile, 'w') as series:
+                if self.seriesFile.endswith('.json'):
+                    json.dump(self.time_series, series, indent=2)
+                    series.write("\n")
+                else:
+                    series.write(",".join(fields) + "\n")
+                    for sample in self.time_series:
+                        series.write("%.3f,%.1f,%.1f,%.1f,%d\n" % tuple(sample[field] for field in fields))
+        except OSError as e:
+            print("Can not write time series to %s: %s" % (self.seriesFile, str(e)))
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Wrote %d one second samples to %s" % (len(self.time_series), self.seriesFile))
+
+    def write_result(self):
+
+        if self.resultFile is None:
+            return
+
+        self.end_time = datetime.datetime.now().replace(microsecond=0)
+        merged = self.merged_latency_stats()
+        overall = self.overall_latency(merged)
+        opened, requests = self.connection_stats()
+        config = {name: value for name, value in vars(self.token).items()
+                  if name not in ('arglist', 'argCount', 'agentToken') and isinstance(value, (str, int, float, bool, list, tuple, type(None)))}
+
+        result = {
+            'version': RESULT_VERSION,
+            'started': self.start_time.isoformat(),
+            'ended': self.end_time.isoformat(),
+            'config': config,
+            'environment': {
+                'host': platform.node(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'boto3': boto3.__version__,
+                'botocore': botocore.__version__,
+                'cpus': os.cpu_count(),
+            },
+            'totals': overall.summary(),
+            'operations': {op: merged[op].summary() for op in sorted(merged, key=report_order)},
+            'connections': {'opened': opened, 'requests': requests},
+            'errors': {
+                'requests': [[op, name, n] for (op, name), n in sorted(self.merged_request_counts().items())],
+                'failures': [[op, code, n] for (op, code), n in sorted(self.failures.items())],
+                'failed': sum(self.failures.values()),
+                'stopped': self.stop_run,
+            },
+            'verify': dict(self.verify_counts),
+            'skipped': {op.upper(): n for op, n in self.mix_skips.items()},
+            'series': self.time_series,
+        }
+
+        try:
+            with open(self.resultFile, 'w') as output:
+                json.dump(result, output, indent=2)
+                output.write("\n")
+        except OSError as e:
+            print("Can not write result to %s: %s" % (self.resultFile, str(e)))
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Wrote result to %s" % self.resultFile)
+
+    def cpu_seconds(self):
+
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+    def print_loopback_stats(self):
+
+        if self.loopbackMode is None:
+            return
+
+        cpu = self.cpu_seconds() - self.cpu_start
+        overall = self.overall_latency(self.merged_latency_stats())
+        if cpu <= 0 or overall.count == 0:
+            return
+
+        print("Loopback (%s): client used %.2f CPU seconds, %.1f ops and %s per CPU second" %
+              (self.loopbackMode, cpu, overall.count / cpu, formatSize(overall.bytes / cpu)))
+
+    def print_status_thread(self, q):
+
+        last = self.counter_totals()
+        last_time = time.perf_counter()
+        next_tick = last_time + 1
+
+        while self.status_thread_run == 1:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += 1
+            sample, last, last_time = self.sample_counters(last, last_time)
+            while not q.empty():
+                self.percentage = (q.get() / self.opCount) * 100
+            if not self.statusFlag:
+                continue
+            rates = "%s/s, %.0f ops/s, %.0f errors/s, %d in flight" % (formatSize(sample['bytes_per_sec']), sample['ops_per_sec'], sample['errors_per_sec'], sample['inflight'])
+            if self.run_until is not None:
+                remaining = max(0, self.run_until - time.perf_counter())
+                print("Operation %d in progress, %d seconds remaining, %s ... " % (self.current_file, remaining, rates), end='\r')
+            else:
+                print("File %d of %d in progress, %d%% completed, %s ... " % (self.current_file, self.opCount, self.percentage, rates), end='\r')
+
+        if not self.statusFlag:
+            return
+
+        if self.run_until is not None:
+            sys.stdout.write("\rOperation Complete.\033[K\n")
+            print("%d operations processed." % self.current_file)
+            return
+
+        sys.stdout.write("\rOperation Complete.\033[K\n")
+        print("%d files processed." % self.current_file)
+        return
+
+    def upload_file(self, payload, bucket, name):
+
+        try:
+            response = self.s3.upload_fileobj(payload, bucket, name, Callback=self.status_callback)
+            if self.current_file == self.opCount:
+                print("")
+        except (botocore.exceptions.ClientError, boto3.exceptions.S3UploadFailedError) as e:
+            if self.percentage > 0:
+                print("")
+                print("Transferred %s" % formatSize(round(self.xfer_total * (self.percentage/100))))
+            print("Can not upload object %s: %s" % (name, str(e)))
+            sys.exit(1)
+
+    def upload_file_thread(self, payload, bucket, name, digest=None):
+
+        if self.explicitMultipart and len(payload) >= self.multipartThreshold:
+            self.multipart_upload_thread(payload, bucket, name, digest)
+            return
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.upload_fileobj(payload, bucket, name, ExtraArgs=self.upload_args(payload, digest),
+                                                Callback=self.transfer_callback(), Config=self.transferConfig)
+            self.record_transfer('PUT', start, time.perf_counter(), len(payload))
+        except (ClientError, botocore.exceptions.BotoCoreError, boto3.exceptions.S3UploadFailedError) as e:
+            raise operation_error('PUT', error_code(e), "Can not upload object %s: %s" % (name, str(e)))
+
+        return
+
+    def upload_args(self, payload, digest=None):
+
+        if not self.verifyData:
+            return None
+
+        return {'Metadata': {'s3test-md5': digest or payload.digest()}}
+
+    def part_executor(self):
+
+        executor = getattr(self.thread_local, 'part_executor', None)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.partConcurrency)
+            self.thread_local.part_executor = executor
+
+        return executor
+
+    def upload_part_thread(self, thread_s3, bucket, name, upload_id, part_number, payload, callback):
+
+        start = time.perf_counter()
+        response = thread_s3.upload_part(Bucket=bucket, Key=name, UploadId=upload_id, PartNumber=part_number,
+                                         Body=payload, ContentLength=len(payload))
+        self.record_latency('PART', start, time.perf_counter(), len(payload))
+        callback(len(payload))
+
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def multipart_upload_thread(self, payload, bucket, name, digest=None):
+
+        thread_s3 = self.get_thread_client()
+        size = len(payload)
+        part_size = max(self.partSize, math.ceil(size / 10000))
+        upload_id = None
+
+        try:
+            start = time.perf_counter()
+            upload_id = thread_s3.create_multipart_upload(Bucket=bucket, Key=name, **(self.upload_args(payload, digest) or {}))['UploadId']
+            executor = self.part_executor()
+            callback = self.transfer_callback()
+            futures = []
+            for part_number, offset in enumerate(range(0, size, part_size), start=1):
+                part = payload.part(offset, min(part_size, size - offset))
+                futures.append(executor.submit(self.upload_part_thread, thread_s3, bucket, name, upload_id, part_number, part, callback))
+            parts = [future.result() for future in futures]
+            thread_s3.complete_multipart_upload(Bucket=bucket, Key=name, UploadId=upload_id, MultipartUpload={'Parts': parts})
+            self.record_transfer('PUT', start, time.perf_counter(), size)
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            if upload_id is not None:
+                try:
+                    thread_s3.abort_multipart_upload(Bucket=bucket, Key=name, UploadId=upload_id)
+                except (ClientError, botocore.exceptions.BotoCoreError):
+                    pass
+            raise operation_error('PUT', error_code(e), "Can not upload object %s: %s" % (name, str(e)))
+
+    def download_file(self, obj_name, bucket, dest=None):
+
+        if dest is None:
+            dest = '/dev/null'
+
+        try:
+            response = self.s3.download_file(bucket, obj_name, dest, Callback=self.status_callback)
+            if self.current_file == self.opCount:
+                print("")
+        except (ClientError, PermissionError) as e:
+            if self.percentage > 0:
+                print("")
+                print("Transferred %s" % formatSize(round(self.xfer_total * (self.percentage/100))))
+            print("Can not download object %s: %s" % (obj_name, str(e)))
+            sys.exit(1)
+
+    def sink_buffer(self):
+
+        buffer = getattr(self.thread_local, 'sink', None)
+        if buffer is None:
+            buffer = memoryview(bytearray(self.sinkBuffer))
+            self.thread_local.sink = buffer
+
+        return buffer
+
+    def stream_object_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+        buffer = self.sink_buffer()
+        checksum = hashlib.md5() if self.verifyData else None
+        received = 0
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.get_object(Bucket=bucket, Key=obj_name)
+            body = response['Body']
+            while True:
+                amount = body.readinto(buffer)
+                if amount == 0:
+                    break
+                if checksum is not None:
+                    checksum.update(buffer[:amount])
+                received += amount
+                self.thread_status_callback(amount)
+            end = time.perf_counter()
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('GET', error_code(e), "Can not download object %s: %s" % (obj_name, str(e)))
+
+        if checksum is not None:
+            self.verify_object(obj_name, response, checksum.hexdigest())
+        self.record_transfer('GET', start, end, received)
+
+    def verify_object(self, obj_name, response, digest):
+
+        expected = response.get('Metadata', {}).get('s3test-md5')
+        if expected is None and self.manifest_sums is not None:
+            expected = self.manifest_sums.get(self.key_number(obj_name))
+        if expected is None:
+            etag = response.get('ETag', '').strip('"')
+            if len(etag) == 32 and '-' not in etag:
+                expected = etag
+
+        if expected is None:
+            with self.counter_lock:
+                self.verify_counts['unchecked'] += 1
+            return
+
+        if digest != expected:
+            with self.counter_lock:
+                self.verify_counts['mismatched'] += 1
+            raise operation_error('GET', 'checksum', "Checksum mismatch for object %s: expected %s, read %s" % (obj_name, expected, digest))
+
+        with self.counter_lock:
+            self.verify_counts['verified'] += 1
+
+    def print_verify_stats(self):
+
+        if not self.verifyData or len(self.verify_counts) == 0:
+            return
+
+        print("Verified %d objects, %d mismatched, %d without a checksum to compare" %
+              (self.verify_counts['verified'], self.verify_counts['mismatched'], self.verify_counts['unchecked']))
+
+    def download_file_thread(self, obj_name, bucket, dest):
+
+        if dest == '/dev/null':
+            self.stream_object_thread(obj_name, bucket)
+            return
+
+        thread_s3 = self.get_thread_client()
+        transferred = []
+        callback = self.transfer_callback()
+
+        def progress(number):
+            transferred.append(number)
+            callback(number)
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.download_file(bucket, obj_name, dest, Callback=progress, Config=self.transferConfig)
+            self.record_transfer('GET', start, time.perf_counter(), sum(transferred))
+        except (ClientError, botocore.exceptions.BotoCoreError, boto3.exceptions.Boto3Error, OSError) as e:
+            raise operation_error('GET', error_code(e), "Can not download object %s: %s" % (obj_name, str(e)))
+
+    def head_file_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.head_object(Bucket=bucket, Key=obj_name)
+            self.record_latency('HEAD', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('HEAD', error_code(e), "Can not head object %s: %s" % (obj_name, str(e)))
+
+    def exists_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            try:
+                response = thread_s3.head_object(Bucket=bucket, Key=obj_name)
+                found = True
+            except ClientError as e:
+                if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 404:
+                    raise
+                found = False
+            self.record_latency('EXISTS', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('EXISTS', error_code(e), "Can not check object %s: %s" % (obj_name, str(e)))
+
+        with self.counter_lock:
+            self.exists_counts['found' if found else 'missing'] += 1
+
+    def copy_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.copy_object(Bucket=bucket, Key=obj_name + '-copy', CopySource={'Bucket': bucket, 'Key': obj_name})
+            self.record_latency('COPY', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('COPY', error_code(e), "Can not copy object %s: %s" % (obj_name, str(e)))
+
+    def put_tag_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.put_object_tagging(Bucket=bucket, Key=obj_name,
+                                                    Tagging={'TagSet': [{'Key': 's3test', 'Value': str(self.randomSeed)}]})
+            self.record_latency('PUTTAG', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('PUTTAG', error_code(e), "Can not tag object %s: %s" % (obj_name, str(e)))
+
+    def get_tag_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.get_object_tagging(Bucket=bucket, Key=obj_name)
+            self.record_latency('GETTAG', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('GETTAG', error_code(e), "Can not read tags of object %s: %s" % (obj_name, str(e)))
+
+    def put_empty_thread(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.put_object(Bucket=bucket, Key=obj_name, Body=b'')
+            self.record_latency('PUT0', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('PUT0', error_code(e), "Can not write empty object %s: %s" % (obj_name, str(e)))
+
+    def delete_file(self, obj_name, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.delete_object(Bucket=bucket, Key=obj_name)
+            self.record_latency('DELETE', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('DELETE', error_code(e), "Can not delete object %s: %s" % (obj_name, str(e)))
+
+    def delete_batch_thread(self, keys, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+            self.record_latency('BULKDEL', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            with self.counter_lock:
+                self.delete_errors += len(keys)
+            raise operation_error('BULKDEL', error_code(e), "Can not delete %d objects starting with %s: %s" % (len(keys), keys[0], str(e)))
+
+        errors = response.get('Errors', [])
+        with self.counter_lock:
+            self.delete_count += len(keys) - len(errors)
+            self.delete_errors += len(errors)
+        if len(errors) > 0:
+            self.thread_counter().errors += len(errors)
+            for error in errors:
+                self.record_failure(operation_error('DELETE', error.get('Code', 'Unknown'),
+                                                    "Can not delete object %s: %s" % (error.get('Key'), error.get('Message'))))
+
+    def list_bucket(self, quiet=False, benchmark=False):
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        bucket_name = self.bucketName
+
+        try:
+            bucket_region = self.s3.get_bucket_location(Bucket=bucket_name)
+            self.bucketRegion = bucket_region
+        except ClientError as e:
+            print("Error: connection to %s failed: %s" % (self.endPoint, str(e)))
+            sys.exit(1)
+
+        prefixes = self.list_prefixes()
+
+        self.list_keys = 0
+        self.list_pages = 0
+        self.list_error = False
+        start_time = time.perf_counter()
+
+        if len(prefixes) == 1:
+            self.list_prefix_thread(prefixes[0], quiet, benchmark)
+        else:
+            thread_set = []
+            for prefix in prefixes:
+                list_thread = threading.Thread(target=self.list_prefix_thread, args=(prefix, quiet, benchmark,))
+                list_thread.start()
+                thread_set.append(list_thread)
+            for list_thread in thread_set:
+                list_thread.join()
+
+        self.list_elapsed = time.perf_counter() - start_time
+
+        if self.list_error:
+            sys.exit(1)
+
+    def load_object_list(self):
+
+        if self.manifestFile is None:
+            self.list_bucket(quiet=True)
+            return
+
+        limit = self.keyStart + int(self.list_limit or self.opCount)
+        if self.verifyData:
+            self.manifest_sums = {}
+
+        for name, size, digest in self.read_manifest():
+            number = self.key_number(name)
+            if number is None or not self.keyStart < number <= limit:
+                continue
+            self.xfer_total += size
+            if self.list_numbers is not None:
+                self.list_numbers.append(number)
+            if self.object_sizes is not None:
+                self.object_sizes[number] = size
+            if self.manifest_sums is not None:
+                self.manifest_sums[number] = digest
+
+    def read_manifest(self):
+
+        try:
+            with open(self.manifestFile, 'r') as manifest:
+                header = manifest.readline().rstrip('\n').split('\t')
+                if len(header) < 3 or header[0] != MANIFEST_HEADER:
+                    print("Error: %s is not an s3test manifest." % self.manifestFile)
+                    sys.exit(1)
+                if header[2] != self.bucketName:
+                    print("Error: manifest %s was written for bucket %s." % (self.manifestFile, header[2]))
+                    sys.exit(1)
+                for line in manifest:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 3 or not fields[1].isdigit() or len(fields[2]) != 32:
+                        continue
+                    yield fields[0], int(fields[1]), fields[2]
+        except OSError as e:
+            print("Can not read manifest %s: %s" % (self.manifestFile, str(e)))
+            sys.exit(1)
+
+    def list_prefixes(self):
+
+        if self.hashKeys and self.listShards:
+            return [digit for digit in '0123456789abcdef']
+        elif self.hashKeys:
+            return ['']
+        elif self.listShards:
+            return [self.filePrefix + '-' + str(digit) for digit in range(1, 10)]
+        else:
+            return [self.filePrefix + '-']
+
+    def list_prefix_thread(self, prefix, quiet, benchmark):
+
+        thread_s3 = self.get_thread_client()
+        numbers = []
+
+        try:
+            kwargs = {'Bucket': self.bucketName, 'Prefix': prefix}
+            while True:
+                start = time.perf_counter()
+                block = thread_s3.list_objects_v2(**kwargs)
+                if benchmark:
+                    self.record_latency('LIST', start, time.perf_counter())
+                contents = block.get('Contents', [])
+                size = 0
+                for obj_entry in contents:
+                    obj_number = self.key_number(obj_entry['Key'])
+                    if obj_number is None:
+                        continue
+                    if self.keyStart < obj_number <= self.keyStart + int(self.list_limit or self.opCount):
+                        if self.list_numbers is not None:
+                            numbers.append(obj_number)
+                        if self.object_sizes is not None:
+                            self.object_sizes[obj_number] = obj_entry['Size']
+                        size += obj_entry['Size']
+                        if not quiet:
+                            print("%s" % obj_entry['Key'])
+                with self.counter_lock:
+                    self.xfer_total += size
+                    self.list_keys += len(contents)
+                    self.list_pages += 1
+                    if self.list_numbers is not None:
+                        self.list_numbers.extend(numbers)
+                numbers = []
+                if block['IsTruncated']:
+                    kwargs['ContinuationToken'] = block['NextContinuationToken']
+                else:
+                    break
+        except (botocore.exceptions.ClientError, botocore.exceptions.EndpointConnectionError) as e:
+            print("Error: can not connect to bucket %s: %s" % (self.bucketName, str(e)))
+            self.list_error = True
+
+    def print_list_stats(self):
+
+        if self.list_elapsed <= 0:
+            return
+
+        print("Listed %d keys in %d pages: %.1f pages/sec, %.1f keys/sec" % (self.list_keys, self.list_pages,
+                                                                              self.list_pages / self.list_elapsed,
+                                                                              self.list_keys / self.list_elapsed))
+
+    def create_payload(self):
+
+        if self.payload is None:
+            self.payload = payload_buffer(self.payloadSize)
+            if self.uniqueData and not self.payload.check():
+                print("Error: unique payload data depends on read size.")
+                sys.exit(1)
+
+        return self.payload
+
+    def payload_offset(self, number):
+
+        if self.uniqueData:
+            return number * 4099
+
+        return 0
+
+    def payload_seed(self, number):
+
+        if self.uniqueData:
+            return number
+
+        return None
+
+    def worker_pool_thread(self, work_q, status_q, target, item_size):
+
+        self.thread_local.pooled = True
+
+        while True:
+            work_entry = work_q.get()
+            if work_entry is None:
+                executor = getattr(self.thread_local, 'part_executor', None)
+                if executor is not None:
+                    executor.shutdown()
+                break
+            work_item, intended = work_entry
+            if self.stop_run:
+                continue
+            if self.run_until is not None and (intended if intended is not None else time.perf_counter()) >= self.run_until:
+                continue
+            if intended is not None:
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.thread_local.intended_start = intended
+            self.advance_file(status_q, 1 if item_size is None else item_size(work_item))
+            counter = self.thread_counter()
+            counter.inflight += 1
+            try:
+                target(*work_item)
+                counter.ops += 1
+            except operation_skipped:
+                pass
+            except operation_error as e:
+                counter.errors += 1
+                self.record_failure(e)
+            except Exception as e:
+                # Anything unexpected still counts against --on-error rather than killing the worker
+                counter.errors += 1
+                self.record_failure(operation_error(self.opType.upper(), type(e).__name__, "Unexpected error in %s: %s" % (self.opType, str(e) or type(e).__name__)))
+            finally:
+                counter.inflight -= 1
+
+    def advance_file(self, status_q, amount=1):
+
+        with self.counter_lock:
+            self.current_file += amount
+            status_q.put(self.current_file)
+
+        if self.progressCounter is not None:
+            with self.progressCounter.get_lock():
+                self.progressCounter.value += amount
+
+    def run_worker_pool(self, target, work_items, status_q, item_size=None):
+
+        threads = max(1, self.threadCount)
+        work_q = queue.Queue(maxsize=threads * 4)
+        pool = []
+
+        for x in range(threads):
+            worker = threading.Thread(target=self.worker_pool_thread, args=(work_q, status_q, target, item_size,))
+            worker.start()
+            pool.append(worker)
+
+        if self.requestRate > 0:
+            interval = 1 / self.requestRate
+            schedule_start = time.perf_counter()
+            for n, work_item in enumerate(work_items):
+                if self.stop_run:
+                    break
+                work_q.put((work_item, schedule_start + (n * interval),))
+        else:
+            for work_item in work_items:
+                if self.stop_run:
+                    break
+                work_q.put((work_item, None,))
+
+        for x in range(threads):
+            work_q.put(None)
+
+        for worker in pool:
+            worker.join()
+
+    def put_test(self):
+
+        count = self.opCount
+        self.xfer_total = self.expected_size(count)
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Beginning PUT test with %d objects of size %s" % (count, str(self.sizeDist)))
+            if self.sizeDist.fixed():
+                print("Total size: %s" % formatSize(self.xfer_total))
+            else:
+                print("Expected total size: %s (seed %d)" % (formatSize(self.xfer_total), self.randomSeed))
+
+        payload = self.create_payload()
+
+        for x in range(count):
+            self.current_file = x + 1
+            obj_name = self.object_name(self.current_file)
+            self.upload_file(payload.reader(self.object_size(self.current_file), self.payload_offset(self.current_file),
+                                            self.payload_seed(self.current_file)), self.bucketName, obj_name)
+
+    def put_test_thread(self):
+
+        count = self.opCount
+        self.xfer_total = self.expected_size(count)
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Beginning PUT test with %d objects of size %s" % (count, str(self.sizeDist)))
+            if self.sizeDist.fixed():
+                print("Total size: %s" % formatSize(self.xfer_total))
+            else:
+                print("Expected total size: %s (seed %d)" % (formatSize(self.xfer_total), self.randomSeed))
+
+        payload = self.create_payload()
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        work_items = ((payload.reader(self.object_size(x + 1), self.payload_offset(x + 1), self.payload_seed(x + 1)), self.bucketName, self.object_name(x + 1),)
+                      for x in range(self.keyStart, self.keyStart + count))
+        self.run_worker_pool(self.upload_file_thread, work_items, q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+    def prepare_object_thread(self, payload, bucket, name):
+
+        digest = payload.digest()
+        self.upload_file_thread(payload, bucket, name, digest)
+
+        try:
+            with self.manifest_lock:
+                self.manifest_out.write("%s\t%d\t%s\n" % (name, len(payload), digest))
+        except OSError as e:
+            raise operation_error('MANIFEST', type(e).__name__, "Can not record object %s in %s: %s" % (name, self.manifestFile, str(e)))
+
+    def prepare_test(self):
+
+        count = self.opCount
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.manifestFile is None:
+            print("Error: prepare needs a --manifest file to record and resume from.")
+            sys.exit(1)
+
+        done = bytearray(count)
+        written = 0
+        if os.path.exists(self.manifestFile):
+            for name, size, digest in self.read_manifest():
+                number = self.key_number(name)
+                if number is not None and self.keyStart < number <= self.keyStart + count and not done[number - self.keyStart - 1]:
+                    done[number - self.keyStart - 1] = 1
+                    written += 1
+
+        try:
+            self.manifest_out = open(self.manifestFile, 'a', buffering=1)
+        except OSError as e:
+            print("Can not open manifest %s: %s" % (self.manifestFile, str(e)))
+            sys.exit(1)
+        if self.manifest_out.tell() == 0:
+            self.manifest_out.write("%s\t1\t%s\t%s\n" % (MANIFEST_HEADER, self.bucketName, self.filePrefix))
+
+        self.xfer_total = self.expected_size(count - written)
+
+        if self.verboseFlag:
+            print("Beginning PREPARE of %d objects of size %s, manifest %s" % (count, str(self.sizeDist), self.manifestFile))
+        if written > 0:
+            print("Resuming: %d of %d objects already in the manifest." % (written, count))
+
+        payload = self.create_payload()
+        self.current_file = written
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        work_items = ((payload.reader(self.object_size(x + 1), self.payload_offset(x + 1), self.payload_seed(x + 1)), self.bucketName, self.object_name(x + 1),)
+                      for x in range(self.keyStart, self.keyStart + count) if not done[x - self.keyStart])
+        self.run_worker_pool(self.prepare_object_thread, work_items, q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        self.manifest_out.close()
+        self.manifest_out = None
+
+    def get_test(self):
+
+        count = self.opCount
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        self.load_object_list()
+
+        if self.verboseFlag:
+            print("Beginning GET test for %d objects" % count)
+            print("Total size: %s" % formatSize(self.xfer_total))
+
+        for x in range(count):
+            self.current_file = x + 1
+            obj_name = self.object_name(self.current_file)
+            if self.destDir == '/dev/null':
+                dest_name = '/dev/null'
+            else:
+                dest_name = self.destDir + '/' + obj_name
+            self.download_file(obj_name, self.bucketName, dest=dest_name)
+
+    def get_test_thread(self):
+
+        count = self.opCount
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.verifyData and self.destDir != '/dev/null':
+            print("Error: --verify checks GET data in memory and does not support a destination directory.")
+            sys.exit(1)
+
+        if not self.skipList and self.keyDist.sequential():
+            self.load_object_list()
+
+        if self.verboseFlag and self.keyDist.sequential():
+            print("Beginning GET test for %d objects" % count)
+            print("Total size: %s" % formatSize(self.xfer_total))
+        elif self.verboseFlag:
+            print("Beginning GET test for %d requests over %d keys (%s)" % (count, self.keyDist.key_count, str(self.keyDist)))
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        self.run_worker_pool(self.download_file_thread, self.get_work_items(count), q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+    def get_work_items(self, count):
+
+        for number in self.get_key_numbers(count):
+            obj_name = self.object_name(number)
+            if self.destDir == '/dev/null':
+                dest_name = '/dev/null'
+            else:
+                dest_name = self.destDir + '/' + obj_name
+            yield (obj_name, self.bucketName, dest_name,)
+
+    def head_test_thread(self):
+
+        count = self.opCount
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.verboseFlag and self.keyDist.sequential():
+            print("Beginning HEAD test for %d objects" % count)
+        elif self.verboseFlag:
+            print("Beginning HEAD test for %d requests over %d keys (%s)" % (count, self.keyDist.key_count, str(self.keyDist)))
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        work_items = ((self.object_name(number), self.bucketName,) for number in self.get_key_numbers(count))
+        self.run_worker_pool(self.head_file_thread, work_items, q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+    def metadata_test(self, op):
+
+        count = self.opCount
+        targets = {
+            'exists': self.exists_thread,
+            'copy': self.copy_thread,
+            'put-tag': self.put_tag_thread,
+            'get-tag': self.get_tag_thread,
+            'put-empty': self.put_empty_thread,
+        }
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Beginning %s test for %d requests over %d keys (%s)" % (op.upper(), count, self.keyDist.key_count, str(self.keyDist)))
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        work_items = ((self.object_name(number), self.bucketName,) for number in self.get_key_numbers(count))
+        self.run_worker_pool(targets[op], work_items, q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        if op == 'exists' and self.statusFlag:
+            print("%d objects found, %d missing." % (self.exists_counts['found'], self.exists_counts['missing']))
+
+    def delete_test(self):
+
+        count = self.opCount
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        q = queue.Queue()
+
+        if self.verboseFlag:
+            if self.singleDelete:
+                print("Beginning DELETE test for %d objects" % count)
+            else:
+                print("Beginning DELETE test for %d objects in batches of %d" % (count, DELETE_BATCH_SIZE))
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        if self.singleDelete:
+            work_items = ((self.object_name(x + 1), self.bucketName,) for x in range(self.keyStart, self.keyStart + count))
+            self.run_worker_pool(self.delete_file, work_items, q)
+        else:
+            self.run_worker_pool(self.delete_batch_thread, self.delete_work_items(count), q, item_size=lambda work_item: len(work_item[0]))
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        if self.delete_errors > 0:
+            print("%d objects could not be deleted." % self.delete_errors)
+
+        batches = self.merged_latency_stats().get('BULKDEL')
+        if self.statusFlag and not self.singleDelete and batches is not None and batches.last_end > batches.first_start:
+            deleted = self.delete_count
+            print("%d objects deleted at %.1f objects/sec." % (deleted, deleted / (batches.last_end - batches.first_start)))
+
+    def delete_work_items(self, count):
+
+        batch = []
+        for x in range(self.keyStart, self.keyStart + count):
+            batch.append(self.object_name(x + 1))
+            if len(batch) == DELETE_BATCH_SIZE:
+                yield (batch, self.bucketName,)
+                batch = []
+
+        if len(batch) > 0:
+            yield (batch, self.bucketName,)
+
+    def list_page_thread(self, bucket):
+
+        thread_s3 = self.get_thread_client()
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.list_objects_v2(Bucket=bucket, Prefix=self.list_prefixes()[0])
+            self.record_latency('LIST', start, time.perf_counter())
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('LIST', error_code(e), "Can not list bucket %s: %s" % (bucket, str(e)))
+
+    def mixed_operation(self, op):
+
+        if op in ('get', 'head'):
+            number = self.live_keys.acquire_read()
+            if number is not None:
+                obj_name = self.object_name(number)
+                try:
+                    if op == 'get':
+                        if self.destDir == '/dev/null':
+                            dest_name = '/dev/null'
+                        else:
+                            dest_name = self.destDir + '/' + obj_name
+                        self.download_file_thread(obj_name, self.bucketName, dest_name)
+                    else:
+                        self.head_file_thread(obj_name, self.bucketName)
+                finally:
+                    self.live_keys.release_read(number)
+                return
+        elif op == 'delete':
+            number = self.live_keys.acquire_delete()
+            if number is not None:
+                self.delete_file(self.object_name(number), self.bucketName)
+                return
+        elif op == 'list':
+            self.list_page_thread(self.bucketName)
+            return
+
+        if op != 'put':
+            with self.counter_lock:
+                self.mix_skips[op] += 1
+                self.current_file -= 1
+            raise operation_skipped(op)
+
+        number = self.live_keys.reserve()
+        self.upload_file_thread(self.payload.reader(self.object_size(number), self.payload_offset(number), self.payload_seed(number)),
+                                self.bucketName, self.object_name(number))
+        self.live_keys.add(number)
+
+    def mixed_work_items(self):
+
+        ops = [op for op in self.opMix if self.opMix[op] > 0]
+        weights = [self.opMix[op] for op in ops]
+
+        while time.perf_counter() < self.run_until:
+            yield (random.choices(ops, weights)[0],)
+
+    def range_get_thread(self, obj_name, bucket, first, last):
+
+        thread_s3 = self.get_thread_client()
+        received = 0
+
+        try:
+            start = time.perf_counter()
+            response = thread_s3.get_object(Bucket=bucket, Key=obj_name, Range="bytes=%d-%d" % (first, last))
+            body = response['Body']
+            while True:
+                data = body.read(1048576)
+                if not data:
+                    break
+                received += len(data)
+            self.record_latency('RANGE', start, time.perf_counter(), received)
+        except (ClientError, botocore.exceptions.BotoCoreError) as e:
+            raise operation_error('RANGE', error_code(e), "Can not read range %d-%d of object %s: %s" % (first, last, obj_name, str(e)))
+
+        self.thread_status_callback(received)
+
+    def range_work_items(self, count, sizes):
+
+        rng = random.Random((self.randomSeed * 1000003) + self.keyStart)
+        numbers = sorted(sizes)
+        length = self.rangeSize
+
+        if self.rangeOffsets == 'sequential' and self.keyDist.sequential():
+            issued = 0
+            while issued < count:
+                for number in numbers:
+                    for first in range(0, sizes[number], length):
+                        yield (self.object_name(number), self.bucketName, first, min(first + length, sizes[number]) - 1,)
+                        issued += 1
+                        if issued == count:
+                            return
+            return
+
+        cursor = {}
+        for x in range(count):
+            if self.keyDist.sequential():
+                number = numbers[x % len(numbers)]
+            else:
+                number = self.keyDist.sample(rng)
+                while number not in sizes:
+                    number = self.keyDist.sample(rng)
+                self.key_hits[number] += 1
+            size = sizes[number]
+            if self.rangeOffsets == 'sequential':
+                first = cursor.get(number, 0)
+                cursor[number] = first + length if first + length < size else 0
+            else:
+                first = rng.randrange(0, max(1, size - length + 1))
+            yield (self.object_name(number), self.bucketName, first, min(first + length, size) - 1,)
+
+    def range_test(self):
+
+        count = self.opCount
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if self.rangeKey is not None:
+            self.parallel_range_test()
+            return
+
+        self.object_sizes = {}
+        self.list_limit = self.keyDist.key_count
+        self.load_object_list()
+        sizes = {number: size for number, size in self.object_sizes.items() if size > 0}
+        self.object_sizes = None
+        self.list_limit = None
+
+        if len(sizes) == 0:
+            print("Error: no objects with prefix %s found for range reads." % self.filePrefix)
+            sys.exit(1)
+
+        if self.verboseFlag:
+            print("Beginning RANGE test for %d reads of %s at %s offsets over %d objects" % (count, formatSize(self.rangeSize), self.rangeOffsets, len(sizes)))
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        self.run_worker_pool(self.range_get_thread, self.range_work_items(count, sizes), q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+    def parallel_range_test(self):
+
+        try:
+            size = self.s3.head_object(Bucket=self.bucketName, Key=self.rangeKey)['ContentLength']
+        except ClientError as e:
+            print("Can not find object %s: %s" % (self.rangeKey, str(e)))
+            sys.exit(1)
+
+        ranges = math.ceil(size / self.rangeSize)
+        self.opCount = max(1, ranges)
+
+        if self.verboseFlag:
+            print("Beginning parallel RANGE read of %s (%s) in %d ranges of %s with %d threads" % (self.rangeKey, formatSize(size), ranges, formatSize(self.rangeSize), self.threadCount))
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        start = time.perf_counter()
+        work_items = ((self.rangeKey, self.bucketName, first, min(first + self.rangeSize, size) - 1,) for first in range(0, size, self.rangeSize))
+        self.run_worker_pool(self.range_get_thread, work_items, q)
+        elapsed = time.perf_counter() - start
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        if elapsed > 0:
+            transferred = self.transferred()
+            print("Read %s in %.2f seconds: %s/s aggregate" % (formatSize(transferred), elapsed, formatSize(transferred / elapsed)))
+
+    def mixed_test(self):
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        self.list_numbers = []
+        self.load_object_list()
+        self.live_keys = key_tracker(self.list_numbers, self.keyStart + self.opCount + 1)
+        self.list_numbers = None
+        self.create_payload()
+
+        if self.verboseFlag:
+            mix = ', '.join("%s %g" % (op.upper(), self.opMix[op]) for op in self.opMix)
+            print("Beginning mixed test for %d seconds with %d existing objects (%s)" % (self.runDuration, len(self.live_keys), mix))
+
+        q = queue.Queue()
+
+        self.run_until = time.perf_counter() + self.runDuration
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        self.run_worker_pool(self.mixed_operation, self.mixed_work_items(), q)
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        if len(self.mix_skips) > 0:
+            print("Skipped with no eligible key: %s" % ', '.join("%s %d" % (op.upper(), self.mix_skips[op]) for op in sorted(self.mix_skips)))
+
+        if self.verboseFlag:
+            print("%d objects in the live key set at end of run." % len(self.live_keys))
+
+    def async_test(self, op):
+
+        count = self.opCount
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if op == 'get':
+            if self.destDir != '/dev/null':
+                print("Error: the async engine discards GET data and does not support a destination directory.")
+                sys.exit(1)
+            if self.verifyData:
+                print("Error: the async engine does not support --verify.")
+                sys.exit(1)
+            if not self.skipList and self.keyDist.sequential():
+                self.load_object_list()
+        elif op == 'put':
+            self.xfer_total = self.expected_size(count)
+            self.create_payload()
+
+        if self.verboseFlag:
+            print("Beginning %s test for %d objects with %d requests in flight" % (op.upper(), count, self.inflightCount))
+            if op in ('put', 'get'):
+                print("Total size: %s" % formatSize(self.xfer_total))
+
+        credentials = self.s3session.get_credentials()
+        if credentials is None:
+            print("Error: no credentials found for the async engine.")
+            sys.exit(1)
+        client = async_s3_client(self.endPoint, self.s3.meta.region_name, credentials.get_frozen_credentials(),
+                                 self.token.connectTimeout, self.token.readTimeout)
+
+        q = queue.Queue()
+
+        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
+        status_thread.start()
+
+        asyncio.run(self.async_run(client, op, count, q))
+
+        self.status_thread_run = 0
+        status_thread.join()
+
+        self.remote_connections[0] += client.opened
+        self.remote_connections[1] += client.requests
+
+    async def async_run(self, client, op, count, status_q):
+
+        self.thread_local.pooled = True
+
+        if op in ('get', 'head'):
+            numbers = self.get_key_numbers(count)
+        else:
+            numbers = iter(range(self.keyStart + 1, self.keyStart + count + 1))
+
+        schedule = iter(range(count))
+        interval = 1 / self.requestRate if self.requestRate > 0 else 0
+        schedule_start = time.perf_counter()
+
+        async def worker():
+            for number in numbers:
+                if self.stop_run:
+                    break
+                intended = None
+                if interval > 0:
+                    intended = schedule_start + (next(schedule) * interval)
+                    delay = intended - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self.async_operation(client, op, number, status_q, intended)
+
+        await asyncio.gather(*(worker() for x in range(min(self.inflightCount, max(1, count)))))
+        client.close()
+
+    async def async_operation(self, client, op, number, status_q, intended=None):
+
+        obj_name = self.object_name(number)
+        self.advance_file(status_q)
+        counter = self.thread_counter()
+        counter.inflight += 1
+        requests = self.request_counts()
+        requests[(op.upper(), 'calls')] += 1
+        requests[(op.upper(), 'attempts')] += 1
+
+        start = time.perf_counter()
+        try:
+            if op == 'put':
+                size = self.object_size(number)
+                payload = self.payload.reader(size, self.payload_offset(number), self.payload_seed(number))
+                status, received = await client.request('PUT', self.bucketName, obj_name, body=payload, length=size)
+                received = size
+            else:
+                status, received = await client.request(op.upper(), self.bucketName, obj_name)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            counter.inflight -= 1
+            counter.errors += 1
+            requests[(op.upper(), type(e).__name__)] += 1
+            self.record_failure(operation_error(op.upper(), type(e).__name__, "Can not %s object %s: %s" % (op, obj_name, str(e) or type(e).__name__)))
+            return
+        end = time.perf_counter()
+        counter.inflight -= 1
+
+        if status >= 300:
+            counter.errors += 1
+            requests[(op.upper(), str(status))] += 1
+            self.record_failure(operation_error(op.upper(), str(status), "Can not %s object %s: HTTP status %d" % (op, obj_name, status)))
+            return
+
+        if intended is not None:
+            start = min(start, intended)
+        if op in ('put', 'get'):
+            self.record_transfer(op.upper(), start, end, received)
+        else:
+            self.record_latency(op.upper(), start, end)
+        counter.ops += 1
+        counter.bytes += received
+
+    def run_test(self, op):
+
+        if self.engine == 'async' and op in ('put', 'get', 'head', 'delete'):
+            self.async_test(op)
+        elif op == 'put':
+            self.put_test_thread()
+        elif op == 'get':
+            self.get_test_thread()
+        elif op == 'head':
+            self.head_test_thread()
+        elif op == 'delete':
+            self.delete_test()
+        elif op in METADATA_OPS:
+            self.metadata_test(op)
+
+    def process_result(self):
+
+        return {
+            'files': self.current_file,
+            'bytes': self.transferred(),
+            'histograms': self.merged_latency_stats(),
+            'connections': self.connection_stats(),
+            'key_hits': dict(self.key_hits),
+            'requests': [[op, name, n] for (op, name), n in self.merged_request_counts().items()],
+            'failures': [[op, code, n] for (op, code), n in self.failures.items()],
+            'verify_counts': dict(self.verify_counts),
+            'exists_counts': dict(self.exists_counts),
+        }
+
+    def merge_error_result(self, result):
+
+        requests = collections.Counter({(op, name): n for op, name, n in result['requests']})
+        with self.counter_lock:
+            self.worker_requests.append(requests)
+            for op, code, n in result['failures']:
+                self.failures[(op, code)] += n
+            self.verify_counts.update(result['verify_counts'])
+            self.exists_counts.update(result['exists_counts'])
+            if len(result['failures']) > 0 and self.errorPolicy == 'stop':
+                self.stop_run = True
+
+    def process_test(self, op):
+
+        count = self.opCount
+        processes = min(self.processCount, max(1, count))
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if op == 'get' and not self.skipList and self.keyDist.sequential():
+            self.load_object_list()
+        elif op == 'put':
+            self.xfer_total = self.expected_size(count)
+
+        if self.verboseFlag:
+            print("Beginning %s test for %d objects across %d processes" % (op.upper(), count, processes))
+            if op in ('put', 'get'):
+                print("Total size: %s" % formatSize(self.xfer_total))
+
+        progress = multiprocessing.Value('q', 0)
+        result_q = multiprocessing.Queue()
+        process_set = []
+        key_start = self.keyStart
+
+        for n in range(processes):
+            key_count = (count // processes) + (1 if n < count % processes else 0)
+            worker = multiprocessing.Process(target=process_worker,
+                                             args=(self.token, op, key_start, key_count, self.requestRate * key_count / count, progress, result_q,),
+                                             daemon=True)
+            worker.start()
+            process_set.append(worker)
+            key_start += key_count
+
+        results = []
+        while len(results) < len(process_set):
+            try:
+                results.append(result_q.get(timeout=1))
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in process_set) and result_q.empty():
+                    break
+            self.current_file = progress.value
+            self.percentage = (self.current_file / count) * 100
+            print("File %d of %d in progress, %d%% completed ... " % (self.current_file, count, self.percentage), end='\r')
+
+        for worker in process_set:
+            worker.join()
+
+        for result in results:
+            self.xfer_progress += result['bytes']
+            self.remote_connections[0] += result['connections'][0]
+            self.remote_connections[1] += result['connections'][1]
+            self.key_hits.update(result['key_hits'])
+            self.merge_error_result(result)
+            with self.counter_lock:
+                self.worker_histograms.append(result['histograms'])
+
+        files = sum(result['files'] for result in results)
+        sys.stdout.write("\rOperation Complete.\033[K\n")
+        print("%d files processed." % files)
+        if op in ('put', 'get'):
+            print("Transferred %s" % formatSize(self.transferred()))
+        elif op == 'exists' and self.statusFlag:
+            print("%d objects found, %d missing." % (self.exists_counts['found'], self.exists_counts['missing']))
+
+        failed = len([worker for worker in process_set if worker.exitcode != 0])
+        if failed > 0 or len(results) < len(process_set):
+            print("Warning: %d of %d worker processes did not complete." % (max(failed, len(process_set) - len(results)), len(process_set)))
+
+    def agent_result(self):
+
+        clock_offset = time.time() - time.perf_counter()
+        merged = self.merged_latency_stats()
+
+        return {
+            'files': self.current_file,
+            'bytes': self.transferred(),
+            'histograms': {op: merged[op].to_dict(clock_offset) for op in merged},
+            'connections': list(self.connection_stats()),
+            'key_hits': {str(number): hits for number, hits in self.key_hits.items()},
+            'requests': [[op, name, n] for (op, name), n in self.merged_request_counts().items()],
+            'failures': [[op, code, n] for (op, code), n in self.failures.items()],
+            'verify_counts': dict(self.verify_counts),
+            'exists_counts': dict(self.exists_counts),
+        }
+
+    def driver_test(self, op):
+
+        count = self.opCount
+        agents = self.token.agentList
+        sessions = []
+
+        if self.bucketName is None:
+            print("Error: Bucket name is required.")
+            sys.exit(1)
+
+        if op == 'get' and self.keyDist.sequential():
+            self.load_object_list()
+        elif op == 'put':
+            self.xfer_total = self.expected_size(count)
+
+        if self.verboseFlag:
+            print("Beginning %s test for %d objects across %d agents" % (op.upper(), count, len(agents)))
+            if op in ('put', 'get'):
+                print("Total size: %s" % formatSize(self.xfer_total))
+
+        settings = {field: getattr(self.token, field) for field in AGENT_FIELDS}
+        key_start = 0
+
+        for n, (host, port) in enumerate(agents):
+            key_count = (count // len(agents)) + (1 if n < count % len(agents) else 0)
+            try:
+                connection = socket.create_connection((host, port), timeout=self.token.connectTimeout)
+                connection.settimeout(None)
+            except OSError as e:
+                print("Error: can not connect to agent %s:%d: %s" % (host, port, str(e)))
+                sys.exit(1)
+            stream = connection.makefile('rwb')
+            settings['requestRate'] = self.requestRate * key_count / count
+            agent_send(stream, {'command': 'prepare', 'op': op, 'key_start': key_start, 'key_count': key_count, 'args': settings,
+                                'token': self.token.agentToken})
+            sessions.append(("%s:%d" % (host, port), connection, stream, key_count))
+            key_start += key_count
+
+        for name, connection, stream, key_count in sessions:
+            reply = agent_receive(stream)
+            if reply.get('status') != 'ready':
+                print("Error: agent %s failed to prepare: %s" % (name, reply.get('message')))
+                sys.exit(1)
+
+        for name, connection, stream, key_count in sessions:
+            agent_send(stream, {'command': 'start'})
+
+        print("Test started on %d agents." % len(sessions))
+        print("%-22s %10s %12s %10s %10s %10s" % ("Agent", "Files", "Bytes", "Ops/sec", "p50", "p99"))
+
+        for name, connection, stream, key_count in sessions:
+            reply = agent_receive(stream)
+            connection.close()
+            if reply.get('status') != 'done':
+                print("%-22s failed: %s" % (name, reply.get('message')))
+                continue
+            result = reply['result']
+            histograms = {op_name: latency_histogram.from_dict(data) for op_name, data in result['histograms'].items()}
+            node = latency_histogram()
+            for histogram in histograms.values():
+                node.merge(histogram)
+            print("%-22s %10d %12s %10.1f %10s %10s" % (name, result['files'], formatSize(result['bytes']), node.ops_per_sec(),
+                                                         formatLatency(node.percentile(50)), formatLatency(node.percentile(99))))
+            self.current_file += result['files']
+            self.xfer_progress += result['bytes']
+            self.remote_connections[0] += result['connections'][0]
+            self.remote_connections[1] += result['connections'][1]
+            self.key_hits.update({int(number): hits for number, hits in result['key_hits'].items()})
+            self.merge_error_result(result)
+            with self.counter_lock:
+                self.worker_histograms.append(histograms)
+
+        print("%d files processed." % self.current_file)
+        if op in ('put', 'get'):
+            print("Transferred %s" % formatSize(self.transferred()))
+        elif op == 'exists' and self.statusFlag:
+            print("%d objects found, %d missing." % (self.exists_counts['found'], self.exists_counts['missing']))
+
+    def model_pass(self, op):
+
+        self.current_file = 0
+        self.status_thread_run = 1
+        self.reset_latency_stats()
+        self.cpu_start = self.cpu_seconds()
+        if op == 'put':
+            self.put_test_thread()
+        elif op == 'get':
+            self.get_test_thread()
+
+        overall = self.overall_latency(self.merged_latency_stats())
+
+        return overall.ops_per_sec(), overall.percentile(99)
+
+    def model_point(self, op, threads, iteration):
+
+        self.threadCount = threads
+
+        for x in range(self.modelWarmup):
+            print("%d) -> Warmup pass %d with threads = %d" % (iteration, x + 1, threads))
+            self.model_pass(op)
+
+        rates = []
+        p99 = 0.0
+        for x in range(self.modelReps):
+            print("%d) -> Running test pass %d of %d with threads = %d" % (iteration, x + 1, self.modelReps, threads))
+            rate, latency = self.model_pass(op)
+            rates.append(rate)
+            p99 = max(p99, latency)
+        histograms = self.merged_latency_stats()
+        cpu = self.cpu_seconds() - self.cpu_start
+
+        mean = statistics.mean(rates)
+        if len(rates) > 1:
+            margin = MODEL_T95[max(df for df in MODEL_T95 if df <= len(rates) - 1)] * statistics.stdev(rates) / math.sqrt(len(rates))
+        else:
+            margin = 0.0
+        qualified = self.modelP99 == 0 or p99 * 1000 <= self.modelP99
+
+        return {'threads': threads, 'runs': len(rates), 'rate': mean, 'margin': margin, 'p99': p99, 'qualified': qualified,
+                'histograms': histograms, 'cpu': cpu}
+
+    def thread_model(self, op):
+
+        limit = self.modelMax if self.modelMax > 0 else self.opCount
+        curve = {}
+        best = None
+        iteration = 1
+        threads = 1
+
+        while threads <= limit:
+            point = self.model_point(op, threads, iteration)
+            curve[threads] = point
+            iteration += 1
+            if not point['qualified']:
+                break
+            if best is not None and point['rate'] + point['margin'] < best['rate'] - best['margin']:
+                break
+            if best is None or point['rate'] > best['rate']:
+                best = point
+            threads = threads * 2
+
+        while best is not None:
+            tested = sorted(curve)
+            lower = [t for t in tested if t < best['threads']]
+            upper = [t for t in tested if t > best['threads']]
+            candidates = []
+            if lower and best['threads'] - lower[-1] > 1:
+                candidates.append((lower[-1] + best['threads']) // 2)
+            if upper and upper[0] - best['threads'] > 1:
+                candidates.append((best['threads'] + upper[0]) // 2)
+            if not candidates:
+                break
+            for threads in candidates:
+                point = self.model_point(op, threads, iteration)
+                curve[threads] = point
+                iteration += 1
+                if point['qualified'] and point['rate'] > best['rate']:
+                    best = point
+
+        print("")
+        print("%8s %5s %12s %12s %10s" % ("Threads", "Runs", "Ops/sec", "95% CI", "p99"))
+        for threads in sorted(curve):
+            point = curve[threads]
+            flags = ""
+            if best is not None and threads == best['threads']:
+                flags = " <- best"
+            elif not point['qualified']:
+                flags = " (p99 over %s)" % formatLatency(self.modelP99 / 1000)
+            print("%8d %5d %12.1f %12s %10s%s" % (threads, point['runs'], point['rate'], "+/- %.1f" % point['margin'], formatLatency(point['p99']), flags))
+
+        # Leave the best point's last pass in place for the final report rather than whichever pass ran last
+        self.reset_latency_stats()
+        if best is None:
+            print(" >>> No thread count met the p99 ceiling of %s <<<" % formatLatency(self.modelP99 / 1000))
+        else:
+            print(" >>> Optimal thread count = %d  -> %.1f ops/sec +/- %.1f, p99 %s <<<" % (best['threads'], best['rate'], best['margin'], formatLatency(best['p99'])))
+            with self.counter_lock:
+                self.worker_histograms.append(best['histograms'])
+            self.cpu_start = self.cpu_seconds() - best['cpu']
+            print("Latency below is from the last pass at %d threads." % best['threads'])
+
+class loopback_store:
+
+    def __init__(self, mode, default_size):
+
+        self.mode = mode
+        self.default_size = default_size
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.buckets = collections.defaultdict(dict)
+        self.sorted_keys = {}
+        self.uploads = {}
+        self.upload_count = 0
+
+    def put(self, bucket, key, size, data, metadata):
+
+        if data is None:
+            etag = '"loopback-%d"' % size
+        else:
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+        entry = {'size': size, 'data': data, 'etag': etag, 'metadata': metadata, 'tags': b'', 'modified': time.time()}
+        with self.lock:
+            if key not in self.buckets[bucket]:
+                self.sorted_keys.pop(bucket, None)
+            self.buckets[bucket][key] = entry
+
+        return entry
+
+    def get(self, bucket, key):
+
+        with self.lock:
+            entry = self.buckets[bucket].get(key)
+
+        if entry is None and self.mode == 'discard':
+            entry = {'size': self.default_size, 'data': None, 'etag': '"loopback-%d"' % self.default_size, 'metadata': {}, 'tags': b'', 'modified': self.started}
+
+        return entry
 
-    def register_end(self):
+    def delete(self, bucket, key):
 
-        self.end_time = datetime.datetime.now().replace(microsecond=0)
-        print("End at %s" % self.end_time.strftime("%m/%d/%y %I:%M%p"))
-        print("Run time: ", end='')
-        print(self.end_time - self.start_time)
+        with self.lock:
+            if self.buckets[bucket].pop(key, None) is not None:
+                self.sorted_keys.pop(bucket, None)
 
-    def status_callback(self, number):
+    def list(self, bucket, prefix, start_after, max_keys):
 
-        if self.last_file == self.current_file:
-            return
+        with self.lock:
+            keys = self.sorted_keys.get(bucket)
+            if keys is None:
+                keys = sorted(self.buckets[bucket])
+                self.sorted_keys[bucket] = keys
+            objects = self.buckets[bucket]
+            position = bisect.bisect_right(keys, start_after) if start_after else bisect.bisect_left(keys, prefix)
+            page = []
+            while position < len(keys) and len(page) <= max_keys:
+                key = keys[position]
+                if not key.startswith(prefix):
+                    break
+                if key in objects:
+                    page.append((key, objects[key]))
+                position += 1
 
-        self.percentage += (1 / self.opCount) * 100
-        self.last_file = self.current_file
+        return page[:max_keys], len(page) > max_keys
 
-        print("File %d of %d in progress, %d%% completed ... " % (self.current_file, self.opCount, self.percentage), end='\r')
+class loopback_handler(http.server.BaseHTTPRequestHandler):
 
-    def thread_status_callback(self, number):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'S3TestLoopback'
+    NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+    FILL = bytes(1048576)
 
-        self.xfer_progress += number
+    def setup(self):
 
-    def print_status_thread(self, q):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        while self.status_thread_run == 1:
-            while not q.empty():
-                self.percentage = (q.get() / self.opCount) * 100
-                end_char = '\r'
-                print("File %d of %d in progress, %d%% completed ... " % (self.current_file, self.opCount, self.percentage), end=end_char)
-            time.sleep(1)
+    def log_message(self, format, *args):
 
-        sys.stdout.write("\rOperation Complete.\033[K\n")
-        print("%d files processed." % self.opCount)
         return
 
-    def upload_file(self, file_name, bucket, name=None):
+    def split_path(self):
 
-        if name is None:
-            name = file_name
+        url = urllib.parse.urlsplit(self.path)
+        bucket, sep, key = url.path.lstrip('/').partition('/')
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
 
-        try:
-            response = self.s3.upload_file(file_name, bucket, name, Callback=self.status_callback)
-            if self.current_file == self.opCount:
-                print("")
-        except (botocore.exceptions.ClientError, boto3.exceptions.S3UploadFailedError) as e:
-            if self.percentage > 0:
-                print("")
-                print("Transferred %s" % formatSize(round(self.xfer_total * (self.percentage/100))))
-            print("Can not upload object %s: %s" % (name, str(e)))
-            sys.exit(1)
+        return urllib.parse.unquote(bucket), urllib.parse.unquote(key), query
 
-    def upload_file_thread(self, file_name, bucket, name):
+    def read_chunked(self):
 
-        try:
-            if self.awsProfile:
-                thread_s3session = boto3.Session(profile_name=self.awsProfile,)
-            else:
-                thread_s3session = boto3.Session(profile_name="default",)
-        except botocore.exceptions.ProfileNotFound as e:
-            print("Error: %s" % str(e))
-            sys.exit(1)
-        thread_s3 = thread_s3session.client('s3', endpoint_url=self.endPoint, verify=False, config=self.awsConfig)
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
 
-        try:
-            response = thread_s3.upload_file(file_name, bucket, name, Callback=self.thread_status_callback)
-        except (botocore.exceptions.ClientError, boto3.exceptions.S3UploadFailedError) as e:
-            if self.percentage > 0:
-                print("")
-                print("Transferred %s" % formatSize(self.xfer_progress))
-            print("Can not upload object %s: %s" % (name, str(e)))
-            sys.exit(1)
+        return b''.join(chunks)
 
-        return
+    def decode_aws_chunked(self, raw):
 
-    def download_file(self, obj_name, bucket, dest=None):
+        chunks = []
+        position = 0
+        while position < len(raw):
+            line_end = raw.index(b'\r\n', position)
+            size = int(raw[position:line_end].split(b';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(raw[line_end + 2:line_end + 2 + size])
+            position = line_end + 2 + size + 2
 
-        if dest is None:
-            dest = '/dev/null'
+        return b''.join(chunks)
 
-        try:
-            response = self.s3.download_file(bucket, obj_name, dest, Callback=self.status_callback)
-            if self.current_file == self.opCount:
-                print("")
-        except (ClientError, PermissionError) as e:
-            if self.percentage > 0:
-                print("")
-                print("Transferred %s" % formatSize(round(self.xfer_total * (self.percentage/100))))
-            print("Can not download object %s: %s" % (obj_name, str(e)))
-            sys.exit(1)
+    def read_body(self, keep):
 
-    def download_file_thread(self, obj_name, bucket, dest):
+        encoded = 'aws-chunked' in self.headers.get('Content-Encoding', '')
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            raw = self.read_chunked()
+        elif keep or encoded:
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                remaining -= len(self.rfile.read(min(remaining, 1048576)))
+            return int(self.headers.get('x-amz-decoded-content-length', self.headers.get('Content-Length', 0))), None
 
-        try:
-            if self.awsProfile:
-                thread_s3session = boto3.Session(profile_name=self.awsProfile,)
+        if encoded:
+            raw = self.decode_aws_chunked(raw)
+
+        return len(raw), raw if keep else None
+
+    def reply(self, status, body=b'', headers=None):
+
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if len(body) > 0 and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def reply_xml(self, status, body):
+
+        self.reply(status, ('<?xml version="1.0" encoding="UTF-8"?>' + body).encode('utf-8'), {'Content-Type': 'application/xml'})
+
+    def reply_error(self, status, code, message):
+
+        if self.command == 'HEAD':
+            self.reply(status)
+            return
+        self.reply_xml(status, "<Error><Code>%s</Code><Message>%s</Message></Error>" % (code, escape(message)))
+
+    def object_headers(self, entry):
+
+        headers = {'ETag': entry['etag'], 'Last-Modified': email.utils.formatdate(entry['modified'], usegmt=True), 'Accept-Ranges': 'bytes'}
+        for name, value in entry['metadata'].items():
+            headers['x-amz-meta-' + name] = value
+
+        return headers
+
+    def do_HEAD(self):
+
+        bucket, key, query = self.split_path()
+        if len(key) == 0:
+            self.reply(200)
+            return
+
+        entry = self.server.store.get(bucket, key)
+        if entry is None:
+            self.reply_error(404, 'NoSuchKey', key)
+            return
+
+        self.send_response(200)
+        for name, value in self.object_headers(entry).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(entry['size']))
+        self.end_headers()
+
+    def do_GET(self):
+
+        bucket, key, query = self.split_path()
+        store = self.server.store
+
+        if len(key) == 0:
+            if 'location' in query:
+                self.reply_xml(200, '<LocationConstraint xmlns="%s"/>' % self.NAMESPACE)
             else:
-                thread_s3session = boto3.Session(profile_name="default",)
-        except botocore.exceptions.ProfileNotFound as e:
-            print("Error: %s" % str(e))
-            sys.exit(1)
-        thread_s3 = thread_s3session.client('s3', endpoint_url=self.endPoint, verify=False, config=self.awsConfig)
+                self.list_objects(bucket, query)
+            return
 
-        try:
-            response = thread_s3.download_file(bucket, obj_name, dest, Callback=self.thread_status_callback)
-        except (ClientError, PermissionError) as e:
-            if self.percentage > 0:
-                print("")
-                print("Transferred %s" % formatSize(round(self.xfer_total * (self.percentage/100))))
-            print("Can not download object %s: %s" % (obj_name, str(e)))
-            sys.exit(1)
+        entry = store.get(bucket, key)
+        if entry is None:
+            self.reply_error(404, 'NoSuchKey', key)
+            return
 
-    def delete_file(self, obj_name, bucket):
+        if 'tagging' in query:
+            self.reply_xml(200, '<Tagging xmlns="%s"><TagSet>%s</TagSet></Tagging>' % (self.NAMESPACE, entry['tags'].decode('utf-8')))
+            return
 
-        try:
-            response = self.s3.delete_object(Bucket=bucket, Key=obj_name)
-        except (ClientError) as e:
-            print("Can not delete object %s: %s" % (obj_name, str(e)))
-            sys.exit(1)
+        first, last, status = 0, entry['size'] - 1, 200
+        headers = self.object_headers(entry)
+        byte_range = self.headers.get('Range')
+        if byte_range is not None and byte_range.startswith('bytes=') and entry['size'] > 0:
+            start, sep, end = byte_range[6:].partition('-')
+            first = int(start) if start else max(0, entry['size'] - int(end))
+            last = min(int(end), entry['size'] - 1) if start and end else entry['size'] - 1
+            status = 206
+            headers['Content-Range'] = "bytes %d-%d/%d" % (first, last, entry['size'])
 
-    def list_bucket(self, quiet=False):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(max(0, last - first + 1)))
+        self.end_headers()
 
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
-            sys.exit(1)
+        if entry['data'] is not None:
+            self.wfile.write(memoryview(entry['data'])[first:last + 1])
+            return
+        remaining = last - first + 1
+        while remaining > 0:
+            length = min(remaining, len(self.FILL))
+            self.wfile.write(memoryview(self.FILL)[:length])
+            remaining -= length
 
-        bucket_name = self.bucketName
-        obj_pattern = self.filePrefix + '.+'
-        obj_pattern = '^' + obj_pattern + '$'
+    def list_objects(self, bucket, query):
 
-        try:
-            bucket_region = self.s3.get_bucket_location(Bucket=bucket_name)
-            self.bucketRegion = bucket_region
-        except ClientError as e:
-            print("Error: connection to %s failed: %s" % (self.endPoint, str(e)))
-            sys.exit(1)
+        prefix = query.get('prefix', [''])[0]
+        start_after = query.get('continuation-token', query.get('start-after', ['']))[0]
+        max_keys = min(int(query.get('max-keys', ['1000'])[0]), 1000)
+        page, truncated = self.server.store.list(bucket, prefix, start_after, max_keys)
 
-        try:
-            kwargs = {'Bucket': bucket_name}
-            while True:
-                block = self.s3.list_objects_v2(**kwargs)
-                for obj_entry in block['Contents']:
-                    try:
-                        obj_prefix, obj_number = str(obj_entry['Key']).split('-')
-                        if int(obj_number) <= int(self.opCount) and obj_prefix == self.filePrefix:
-                            self.xfer_total += obj_entry['Size']
-                            if not quiet:
-                                print("%s" % obj_entry['Key'])
-                    except ValueError as e:
-                        continue
-                if block['IsTruncated']:
-                    kwargs['ContinuationToken'] = block['NextContinuationToken']
-                else:
-                    break
-        except (botocore.exceptions.ClientError, botocore.exceptions.EndpointConnectionError) as e:
-            print("Error: can not connect to bucket %s: %s" % (bucket_name,str(e)))
-            sys.exit(1)
+        contents = "".join("<Contents><Key>%s</Key><LastModified>%s</LastModified><ETag>%s</ETag><Size>%d</Size><StorageClass>STANDARD</StorageClass></Contents>" %
+                           (escape(key), datetime.datetime.fromtimestamp(entry['modified'], datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                            escape(entry['etag']), entry['size']) for key, entry in page)
+        token = "<NextContinuationToken>%s</NextContinuationToken>" % escape(page[-1][0]) if truncated else ""
+        self.reply_xml(200, '<ListBucketResult xmlns="%s"><Name>%s</Name><Prefix>%s</Prefix><KeyCount>%d</KeyCount><MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>%s%s</ListBucketResult>' %
+                       (self.NAMESPACE, escape(bucket), escape(prefix), len(page), max_keys, 'true' if truncated else 'false', token, contents))
 
-    def random_string(self, width: int, pool: str = string.ascii_letters) -> set:
+    def do_PUT(self):
 
-        buffer = ''
-        while len(buffer) < width:
-            byte = random.choices(pool, k=1)
-            buffer += str(byte[0])
+        bucket, key, query = self.split_path()
+        store = self.server.store
 
-        return buffer
+        if len(key) == 0:
+            self.read_body(False)
+            self.reply(200)
+            return
 
-    def create_test_file(self, size):
+        if 'tagging' in query:
+            size, data = self.read_body(True)
+            entry = store.get(bucket, key)
+            if entry is None:
+                self.reply_error(404, 'NoSuchKey', key)
+                return
+            tags = xml.etree.ElementTree.fromstring(data).find('{%s}TagSet' % self.NAMESPACE)
+            entry['tags'] = b''.join(xml.etree.ElementTree.tostring(tag, default_namespace=self.NAMESPACE) for tag in (tags if tags is not None else []))
+            self.reply(200)
+            return
 
-        loop_count = math.trunc(size / 1024)
-        loop_remainder = size % 1024
+        if 'partNumber' in query and 'uploadId' in query:
+            size, data = self.read_body(store.mode == 'memory')
+            with store.lock:
+                upload = store.uploads.get(query['uploadId'][0])
+                if upload is not None:
+                    upload['parts'][int(query['partNumber'][0])] = (size, data)
+            if upload is None:
+                self.reply_error(404, 'NoSuchUpload', query['uploadId'][0])
+                return
+            self.reply(200, headers={'ETag': '"part-%s"' % query['partNumber'][0]})
+            return
 
-        temp_fd, filename = tempfile.mkstemp()
-        try:
-            with open(temp_fd, 'w') as test_file:
-                if loop_count > 0:
-                    data = self.random_string(width=1024)
-                    for x in range(loop_count):
-                        test_file.write(data)
-                if loop_remainder > 0:
-                    data = self.random_string(width=loop_remainder)
-                    test_file.write(data)
-        except OSError as e:
-            print("Can not write temp file: %s" % str(e))
-            sys.exit(1)
+        source = self.headers.get('x-amz-copy-source')
+        if source is not None:
+            self.read_body(False)
+            source_bucket, sep, source_key = urllib.parse.unquote(source).lstrip('/').partition('/')
+            original = store.get(source_bucket, source_key)
+            if original is None:
+                self.reply_error(404, 'NoSuchKey', source_key)
+                return
+            entry = store.put(bucket, key, original['size'], original['data'], dict(original['metadata']))
+            self.reply_xml(200, '<CopyObjectResult><LastModified>%s</LastModified><ETag>%s</ETag></CopyObjectResult>' %
+                           (datetime.datetime.fromtimestamp(entry['modified'], datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'), escape(entry['etag'])))
+            return
 
-        test_file.close()
-        return filename
+        size, data = self.read_body(store.mode == 'memory')
+        entry = store.put(bucket, key, size, data, self.metadata())
+        self.reply(200, headers={'ETag': entry['etag']})
 
-    def put_test(self):
+    def metadata(self):
 
-        size = self.dataSize
-        count = self.opCount
-        self.xfer_total = count * size
+        return {name[11:].lower(): value for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-')}
 
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
-            sys.exit(1)
+    def do_POST(self):
 
-        if self.verboseFlag:
-            print("Beginning PUT test with %d objects of size %s" % (count, formatSize(size)))
-            print("Total size: %s" % formatSize(self.xfer_total))
+        bucket, key, query = self.split_path()
+        store = self.server.store
 
-        test_file = self.create_test_file(size)
+        if 'delete' in query:
+            size, data = self.read_body(True)
+            document = xml.etree.ElementTree.fromstring(data)
+            deleted = []
+            for obj in document.iter('{%s}Object' % self.NAMESPACE):
+                name = obj.find('{%s}Key' % self.NAMESPACE).text
+                store.delete(bucket, name)
+                deleted.append(name)
+            quiet = document.find('{%s}Quiet' % self.NAMESPACE)
+            if quiet is not None and quiet.text == 'true':
+                deleted = []
+            self.reply_xml(200, '<DeleteResult xmlns="%s">%s</DeleteResult>' %
+                           (self.NAMESPACE, "".join("<Deleted><Key>%s</Key></Deleted>" % escape(name) for name in deleted)))
+            return
 
-        for x in range(count):
-            self.current_file = x + 1
-            obj_name = self.filePrefix + '-' + str(self.current_file)
-            self.upload_file(test_file, self.bucketName, name=obj_name)
+        if 'uploads' in query:
+            self.read_body(False)
+            with store.lock:
+                store.upload_count += 1
+                upload_id = "upload-%d" % store.upload_count
+                store.uploads[upload_id] = {'parts': {}, 'metadata': self.metadata()}
+            self.reply_xml(200, '<InitiateMultipartUploadResult xmlns="%s"><Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId></InitiateMultipartUploadResult>' %
+                           (self.NAMESPACE, escape(bucket), escape(key), upload_id))
+            return
 
-        os.unlink(test_file)
+        if 'uploadId' in query:
+            self.read_body(False)
+            with store.lock:
+                upload = store.uploads.pop(query['uploadId'][0], None)
+            if upload is None:
+                self.reply_error(404, 'NoSuchUpload', query['uploadId'][0])
+                return
+            parts = [upload['parts'][number] for number in sorted(upload['parts'])]
+            size = sum(part[0] for part in parts)
+            data = b''.join(part[1] for part in parts) if store.mode == 'memory' else None
+            entry = store.put(bucket, key, size, data, upload['metadata'])
+            self.reply_xml(200, '<CompleteMultipartUploadResult xmlns="%s"><Bucket>%s</Bucket><Key>%s</Key><ETag>%s</ETag></CompleteMultipartUploadResult>' %
+                           (self.NAMESPACE, escape(bucket), escape(key), escape(entry['etag'])))
+            return
 
-    def put_test_thread(self):
+        self.read_body(False)
+        self.reply_error(400, 'InvalidRequest', "unsupported request")
 
-        size = self.dataSize
-        count = self.opCount
-        threads = self.threadCount
-        self.xfer_total = count * size
+    def do_DELETE(self):
 
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
-            sys.exit(1)
+        bucket, key, query = self.split_path()
+        store = self.server.store
 
-        if self.verboseFlag:
-            print("Beginning PUT test with %d objects of size %s" % (count, formatSize(size)))
-            print("Total size: %s" % formatSize(self.xfer_total))
+        if 'uploadId' in query:
+            with store.lock:
+                store.uploads.pop(query['uploadId'][0], None)
+        elif len(key) > 0:
+            store.delete(bucket, key)
+        self.reply(204)
 
-        test_file = self.create_test_file(size)
+class loopback_http_server(http.server.ThreadingHTTPServer):
 
-        thread_set = []
-        thread_stat = []
-        q = queue.Queue()
+    # The default listen backlog of 5 overflows at high concurrency and turns into SYN retransmit stalls
+    request_queue_size = 1024
+    daemon_threads = True
 
-        for i in range(threads):
-            thread_stat.append(0)
-            thread_set.append(0)
+def loopback_server(mode, default_size, port_q):
 
-        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
-        status_thread.start()
+    server = loopback_http_server(('127.0.0.1', 0), loopback_handler)
+    server.store = loopback_store(mode, default_size)
+    port_q.put(server.server_address[1])
+    server.serve_forever()
 
-        while self.current_file < self.opCount:
-            for x in range(threads):
-                if thread_stat[x] == 0:
-                    thread_stat[x] = 1
-                    self.current_file += 1
-                    q.put(self.current_file)
-                    obj_name = self.filePrefix + '-' + str(self.current_file)
-                    thread_set[x] = threading.Thread(target=self.upload_file_thread,
-                                                 args=(test_file, self.bucketName, obj_name,))
-                    thread_set[x].start()
-                if self.current_file == self.opCount:
-                    break
-            time.sleep(1)
-            for y in range(threads):
-                if not thread_set[y].is_alive():
-                    thread_stat[y] = 0
+loopback_process = None
 
-        for y in range(threads):
-            thread_set[y].join()
+def start_loopback(runargs):
 
-        self.status_thread_run = 0
-        status_thread.join()
+    global loopback_process
 
-        os.unlink(test_file)
+    port_q = multiprocessing.Queue()
+    server = multiprocessing.Process(target=loopback_server, args=(runargs.loopbackMode, runargs.dataSize, port_q,), daemon=True)
+    server.start()
+    loopback_process = server
+    try:
+        port = port_q.get(timeout=10)
+    except queue.Empty:
+        print("Error: loopback responder did not start.")
+        sys.exit(1)
 
-    def get_test(self):
+    runargs.endPoint = "http://127.0.0.1:%d" % port
+    if runargs.bucketName is None:
+        runargs.bucketName = 'loopback'
+    if runargs.verboseFlag:
+        print("Loopback responder (%s) listening on %s" % (runargs.loopbackMode, runargs.endPoint))
 
-        count = self.opCount
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
-            sys.exit(1)
+    return server
 
-        self.list_bucket(quiet=True)
+def stop_loopback():
 
-        if self.verboseFlag:
-            print("Beginning GET test for %d objects" % count)
-            print("Total size: %s" % formatSize(self.xfer_total))
+    # The exit path uses os._exit, which skips multiprocessing's cleanup of daemon children
+    if loopback_process is not None and loopback_process.is_alive():
+        loopback_process.terminate()
+        loopback_process.join(5)
 
-        for x in range(count):
-            self.current_file = x + 1
-            obj_name = self.filePrefix + '-' + str(self.current_file)
-            if self.destDir == '/dev/null':
-                dest_name = '/dev/null'
-            else:
-                dest_name = self.destDir + '/' + obj_name
-            self.download_file(obj_name, self.bucketName, dest=dest_name)
+def load_result(name):
 
-    def get_test_thread(self):
+    try:
+        with open(name, 'r') as result_file:
+            result = json.load(result_file)
+    except (OSError, ValueError) as e:
+        print("Can not read result %s: %s" % (name, str(e)))
+        sys.exit(1)
 
-        count = self.opCount
-        threads = self.threadCount
+    if result.get('version') != RESULT_VERSION or 'operations' not in result:
+        print("Error: %s is not an s3test result file." % name)
+        sys.exit(1)
 
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
+    return result
+
+def compare_results(argv):
+
+    throughput_limit = 5.0
+    latency_limit = 10.0
+
+    try:
+        options, remainder = getopt.getopt(argv, 'h', ['threshold=', 'p99-threshold=', 'help'])
+    except getopt.GetoptError as e:
+        print("Error: %s" % str(e))
+        usage()
+        sys.exit(1)
+
+    for opt, arg in options:
+        try:
+            if opt == '--threshold':
+                throughput_limit = float(arg)
+            elif opt == '--p99-threshold':
+                latency_limit = float(arg)
+        except ValueError:
+            print("Thresholds must be percentages.")
             sys.exit(1)
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
 
-        self.list_bucket(quiet=True)
+    if len(remainder) < 2:
+        print("Error: compare needs a baseline and at least one result.")
+        sys.exit(1)
 
-        if self.verboseFlag:
-            print("Beginning GET test for %d objects" % count)
-            print("Total size: %s" % formatSize(self.xfer_total))
+    baseline = load_result(remainder[0])
+    regressions = 0
 
-        thread_set = []
-        thread_stat = []
-        q = queue.Queue()
+    print("Baseline %s (%s), regression when ops/sec drops more than %.1f%% or p99 rises more than %.1f%%" %
+          (remainder[0], baseline['started'], throughput_limit, latency_limit))
+    for name in remainder[1:]:
+        result = load_result(name)
+        ops = [op for op in baseline['operations'] if ' ' not in op and '/' not in op]
+        width = max(8, max([len(op) for op in ops] + [0]))
+        print("")
+        print("%s (%s):" % (name, result['started']))
+        print("%-*s %12s %12s %9s %12s %12s %9s" % (width, "Op", "Base ops/s", "Ops/sec", "Change", "Base p99", "p99", "Change"))
+        for op in ops:
+            base = baseline['operations'][op]
+            current = result['operations'].get(op)
+            if current is None:
+                print("%-*s missing from result" % (width, op))
+                regressions += 1
+                continue
+            rate_change = (current['ops_per_sec'] - base['ops_per_sec']) / base['ops_per_sec'] * 100 if base['ops_per_sec'] > 0 else 0.0
+            p99_change = (current['p99'] - base['p99']) / base['p99'] * 100 if base['p99'] > 0 else 0.0
+            flags = []
+            if rate_change < -throughput_limit:
+                flags.append("throughput")
+            if p99_change > latency_limit:
+                flags.append("p99")
+            print("%-*s %12.1f %12.1f %8.1f%% %12s %12s %8.1f%%%s" % (width, op, base['ops_per_sec'], current['ops_per_sec'], rate_change,
+                                                                     formatLatency(base['p99']), formatLatency(current['p99']), p99_change,
+                                                                     "  REGRESSION (%s)" % ", ".join(flags) if flags else ""))
+            if flags:
+                regressions += 1
+        if result['errors']['failed'] > baseline['errors']['failed']:
+            print("Failed operations rose from %d to %d" % (baseline['errors']['failed'], result['errors']['failed']))
 
-        for i in range(threads):
-            thread_stat.append(0)
-            thread_set.append(0)
+    print("")
+    if regressions > 0:
+        print("%d regressions found." % regressions)
+        sys.exit(1)
 
-        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
-        status_thread.start()
+    print("No regressions found.")
+    sys.exit(0)
 
-        while self.current_file < self.opCount:
-            for x in range(threads):
-                if thread_stat[x] == 0:
-                    thread_stat[x] = 1
-                    self.current_file += 1
-                    q.put(self.current_file)
-                    obj_name = self.filePrefix + '-' + str(self.current_file)
-                    if self.destDir == '/dev/null':
-                        dest_name = '/dev/null'
-                    else:
-                        dest_name = self.destDir + '/' + obj_name
-                    thread_set[x] = threading.Thread(target=self.download_file_thread,
-                                                 args=(obj_name, self.bucketName, dest_name,))
-                    thread_set[x].start()
-                if self.current_file == self.opCount:
-                    break
-            time.sleep(1)
-            for y in range(threads):
-                if not thread_set[y].is_alive():
-                    thread_stat[y] = 0
+def process_worker(args, op, key_start, key_count, rate, progress, result_q):
 
-        for y in range(threads):
-            thread_set[y].join()
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-        self.status_thread_run = 0
-        status_thread.join()
+    test = tester(args)
+    test.keyStart = key_start
+    test.opCount = key_count
+    test.requestRate = rate
+    test.verboseFlag = False
+    test.statusFlag = False
+    test.skipList = True
+    test.progressCounter = progress
+    if op == 'get' and test.manifestFile is not None and test.verifyData:
+        test.load_object_list()
 
-    def delete_test(self):
+    test.run_test(op)
 
-        count = self.opCount
-        if self.bucketName is None:
-            print("Error: Bucket name is required.")
-            sys.exit(1)
+    result_q.put(test.process_result())
 
-        q = queue.Queue()
+AGENT_FIELDS = ('bucketName', 'opCount', 'filePrefix', 'dataSize', 'sizeSpec', 'randomSeed', 'endPoint', 'threadCount', 'opType',
+                'poolConnections', 'tcpKeepalive', 'connectTimeout', 'readTimeout', 'uniqueData', 'payloadSize',
+                'processCount', 'engine', 'inflightCount', 'singleDelete',
+                'listShards', 'requestRate', 'keyDistSpec', 'keyCount', 'hashKeys',
+                'multipartThreshold', 'partSize', 'partConcurrency', 'explicitMultipart', 'phaseTiming', 'errorPolicy',
+                'sinkBuffer', 'verifyData')
 
-        if self.verboseFlag:
-            print("Beginning DELETE test for %d objects" % count)
+def agent_send(stream, message):
 
-        status_thread = threading.Thread(target=self.print_status_thread,args=(q,))
-        status_thread.start()
+    stream.write((json.dumps(message) + "\n").encode('utf-8'))
+    stream.flush()
 
-        for x in range(count):
-            self.current_file = x + 1
-            q.put(self.current_file)
-            obj_name = self.filePrefix + '-' + str(self.current_file)
-            self.delete_file(obj_name, self.bucketName)
+def agent_receive(stream):
 
-        self.status_thread_run = 0
-        status_thread.join()
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed by peer")
 
-    def thread_model(self, op):
+    return json.loads(line)
 
-        self.threadCount = 1
-        still_searching = True
-        last_time = 0
-        run_thread_count = 0
-        iteration = 1
+def agent_session(runargs, stream):
 
-        while still_searching and self.threadCount <= self.opCount:
-            print("%d) -> Running test pass with threads = %d" % (iteration, self.threadCount))
-            self.current_file = 0
-            self.status_thread_run = 1
-            start_time = datetime.datetime.now()
-            if op == 'put':
-                self.put_test_thread()
-            elif op == 'get':
-                self.get_test_thread()
-            end_time = datetime.datetime.now()
-            time_diff = end_time - start_time
-            if last_time == 0:
-                last_time = time_diff
-                run_thread_count = self.threadCount
-            else:
-                if time_diff > last_time:
-                    still_searching = False
-                else:
-                    last_time = time_diff
-                    run_thread_count = self.threadCount
-            self.threadCount = self.threadCount * 2
-            iteration += 1
+    message = agent_receive(stream)
+    if message.get('command') != 'prepare':
+        agent_send(stream, {'status': 'error', 'message': "expected prepare command"})
+        return
+
+    if runargs.agentToken is not None and not hmac.compare_digest(str(message.get('token') or ''), runargs.agentToken):
+        agent_send(stream, {'status': 'error', 'message': "agent token mismatch"})
+        return
+
+    op = message['op']
+    if op not in DISTRIBUTED_OPS:
+        agent_send(stream, {'status': 'error', 'message': "operation %s not supported by agents" % op})
+        return
+
+    args = parse_args()
+    for field in AGENT_FIELDS:
+        if field in message['args']:
+            setattr(args, field, message['args'][field])
+    args.awsProfile = runargs.awsProfile
+    args.destDir = runargs.destDir
+
+    try:
+        test = tester(args)
+        test.keyStart = int(message['key_start'])
+        test.opCount = int(message['key_count'])
+        test.verboseFlag = False
+        test.skipList = True
+        if op == 'put':
+            test.create_payload()
+    except SystemExit:
+        agent_send(stream, {'status': 'error', 'message': "agent setup failed"})
+        return
+
+    agent_send(stream, {'status': 'ready'})
+
+    message = agent_receive(stream)
+    if message.get('command') != 'start':
+        return
 
-        print(" >>> Optimal thread count = %d  -> run time %s <<<" % (run_thread_count, last_time))
+    print("Running %s for keys %d to %d" % (op.upper(), test.keyStart + 1, test.keyStart + test.opCount))
+    try:
+        if test.processCount > 1:
+            test.process_test(op)
+        else:
+            test.run_test(op)
+    except SystemExit:
+        agent_send(stream, {'status': 'error', 'message': "test aborted on agent"})
+        return
+
+    agent_send(stream, {'status': 'done', 'result': test.agent_result()})
+
+def run_agent(runargs):
+
+    host, port = runargs.agentListen
+    if runargs.agentToken is None and host not in ('127.0.0.1', '::1', 'localhost'):
+        print("Error: agents listening on %s require --agent-token (or S3TEST_AGENT_TOKEN)." % host)
+        sys.exit(1)
+
+    try:
+        server = socket.create_server((host, port))
+    except OSError as e:
+        print("Error: can not listen on %s:%d: %s" % (host, port, str(e)))
+        sys.exit(1)
+
+    print("Agent listening on %s:%d" % (host, port))
+    while True:
+        connection, address = server.accept()
+        print("Driver connected from %s" % address[0])
+        with connection:
+            stream = connection.makefile('rwb')
+            try:
+                agent_session(runargs, stream)
+            except (OSError, ValueError, KeyError) as e:
+                print("Session with %s ended: %s" % (address[0], str(e)))
 
 def main():
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     signal.signal(signal.SIGINT, signal_handler)
 
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        compare_results(sys.argv[2:])
+
     runargs = parse_args()
     runargs.parse()
 
+    if runargs.agentListen is not None:
+        run_agent(runargs)
+
+    if runargs.loopbackMode is not None:
+        if len(runargs.agentList) > 0:
+            print("Loopback mode runs in a single host and can not drive agents.")
+            sys.exit(1)
+        start_loopback(runargs)
+
     test = tester(runargs)
 
+    if runargs.processCount > 1 and runargs.modelFlag:
+        print("Thread model can not be combined with multiple processes.")
+        sys.exit(1)
+
+    if test.opType in METADATA_OPS and runargs.engine != 'thread':
+        print("Metadata operations run on the thread engine.")
+        sys.exit(1)
+
     if runargs.verboseFlag:
         test.register_start()
 
-    if test.opType == 'put':
+    if len(runargs.agentList) > 0 and test.opType in DISTRIBUTED_OPS:
+        if runargs.modelFlag:
+            print("Thread model can not be combined with agents.")
+            sys.exit(1)
+        test.driver_test(test.opType)
+    elif runargs.processCount > 1 and test.opType in DISTRIBUTED_OPS:
+        test.process_test(test.opType)
+    elif runargs.engine == 'async' and test.opType in ('put', 'get', 'head', 'delete'):
+        if runargs.modelFlag:
+            print("Thread model is only available with the thread engine.")
+            sys.exit(1)
+        test.async_test(test.opType)
+    elif test.opType == 'put':
         if runargs.modelFlag:
             test.thread_model('put')
         else:
             test.put_test_thread()
+    elif test.opType == 'mixed':
+        if runargs.modelFlag or runargs.processCount > 1 or len(runargs.agentList) > 0 or runargs.engine != 'thread':
+            print("Mixed workloads run on the thread engine in a single process.")
+            sys.exit(1)
+        test.mixed_test()
+    elif test.opType == 'prepare':
+        if runargs.modelFlag or runargs.processCount > 1 or len(runargs.agentList) > 0 or runargs.engine != 'thread':
+            print("Prepare runs on the thread engine in a single process.")
+            sys.exit(1)
+        test.prepare_test()
+    elif test.opType == 'range':
+        if runargs.modelFlag or runargs.processCount > 1 or len(runargs.agentList) > 0 or runargs.engine != 'thread':
+            print("Range reads run on the thread engine in a single process.")
+            sys.exit(1)
+        test.range_test()
     elif test.opType == 'list':
-        test.list_bucket()
+        test.list_bucket(benchmark=True)
+        test.print_list_stats()
     elif test.opType == 'get':
         if runargs.modelFlag:
             test.thread_model('get')
         else:
             test.get_test_thread()
+    elif test.opType == 'head':
+        test.head_test_thread()
+    elif test.opType in METADATA_OPS:
+        if runargs.modelFlag:
+            print("Metadata operations run on the thread engine.")
+            sys.exit(1)
+        test.metadata_test(test.opType)
     elif test.opType == 'delete':
         test.delete_test()
     else:
         print("Operation %s not implemented." % test.opType)
         sys.exit(1)
 
+    test.print_latency_stats()
+    test.print_error_stats()
+    test.print_verify_stats()
+    test.print_loopback_stats()
+    test.print_key_spread()
+    test.write_time_series()
+    test.write_result()
+
     if runargs.verboseFlag:
         test.register_end()
 
+    if test.stop_run:
+        sys.exit(1)
+
 if __name__ == '__main__':
 
     try:
         main()
     except SystemExit as e:
+        stop_loopback()
         if e.code == 0:
             os._exit(0)
         else:
-            os._exit(e.code)
\ No newline at end of file
+            os._exit(e.code)
+    else:
+        stop_loopback()